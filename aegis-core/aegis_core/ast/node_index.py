@@ -0,0 +1,114 @@
+from bisect import bisect_left, bisect_right
+
+from mecha import AstNode
+
+__all__ = ["NodeIndex", "get_node_index"]
+
+NODE_INDEX_KEY = "aegis_node_index"
+
+Position = tuple[int, int]
+
+
+class NodeIndex:
+    """
+    The spans of the nodes of a tree sorted by their start, finding the node at a
+    position is a binary search instead of a walk over the whole tree.
+
+    Only the nodes that fit on a single line can be found at a position. They nest
+    within each other, each one keeps the index of the innermost node enclosing it
+    so the search only climbs the nodes containing the position.
+    """
+
+    __slots__ = (
+        "root",
+        "_line_starts",
+        "_line_ends",
+        "_line_nodes",
+        "_parents",
+    )
+
+    root: AstNode
+
+    _line_starts: list[Position]
+    _line_ends: list[int]
+    _line_nodes: list[AstNode]
+    _parents: list[int]
+
+    def __init__(self, root: AstNode):
+        self.root = root
+
+        nodes = list(root.walk())
+
+        single_line = sorted(
+            (
+                i
+                for i, node in enumerate(nodes)
+                if node.location.lineno == node.end_location.lineno
+            ),
+            key=lambda i: (start(nodes[i]), -nodes[i].end_location.colno, i),
+        )
+
+        self._line_nodes = [nodes[i] for i in single_line]
+        self._line_starts = [start(node) for node in self._line_nodes]
+        self._line_ends = [node.end_location.colno for node in self._line_nodes]
+        self._parents = []
+
+        stack: list[int] = []
+        for i, (lineno, _) in enumerate(self._line_starts):
+            while stack and (
+                self._line_starts[stack[-1]][0] != lineno
+                or self._line_ends[stack[-1]] < self._line_ends[i]
+            ):
+                stack.pop()
+
+            self._parents.append(stack[-1] if stack else -1)
+            stack.append(i)
+
+    def at(self, lineno: int, colno: int) -> AstNode:
+        """The innermost node containing the position, the root if there is none"""
+        # Between two nodes the one ending at the position wins over the next one
+        before = self._containing(
+            bisect_left(self._line_starts, (lineno, colno)) - 1, lineno, colno
+        )
+        after = self._containing(
+            bisect_right(self._line_starts, (lineno, colno)) - 1, lineno, colno
+        )
+
+        if after == -1:
+            return self.root if before == -1 else self._line_nodes[before]
+
+        if before != -1 and not self._encloses(before, after):
+            return self._line_nodes[before]
+
+        return self._line_nodes[after]
+
+    def __reduce__(self):
+        # Only the tree is pickled along with the nodes it was attached to
+        return NodeIndex, (self.root,)
+
+    def _containing(self, i: int, lineno: int, colno: int) -> int:
+        while i >= 0 and self._line_starts[i][0] == lineno:
+            if self._line_ends[i] >= colno:
+                return i
+
+            i = self._parents[i]
+
+        return -1
+
+    def _encloses(self, outer: int, inner: int) -> bool:
+        return (
+            self._line_starts[outer] <= self._line_starts[inner]
+            and self._line_ends[inner] <= self._line_ends[outer]
+        )
+
+
+def start(node: AstNode) -> Position:
+    return (node.location.lineno, node.location.colno)
+
+
+def get_node_index(root: AstNode) -> NodeIndex:
+    """The index of the tree, built the first time it is requested"""
+    if not (index := root.__dict__.get(NODE_INDEX_KEY)):
+        index = root.__dict__[NODE_INDEX_KEY] = NodeIndex(root)
+
+    return index
@@ -1 +1,4 @@
+from .calls import *
 from .project_index import *
+from .symbols import *
+from .tags import *
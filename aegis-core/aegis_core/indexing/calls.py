@@ -0,0 +1,110 @@
+from collections import deque
+from threading import Lock
+from typing import Callable, Iterable
+
+from tokenstream import SourceLocation
+
+from .symbols import Symbol
+
+__all__ = ["CallGraph"]
+
+CallSite = tuple[SourceLocation, SourceLocation]
+
+
+class CallGraph:
+    """
+    The calls between the functions and modules of the project.
+
+    Each caller keeps the callees it calls along with the location of the calls within
+    its source, the reverse edges are kept so incoming calls are a single lookup.
+    The calls of a caller are replaced as a whole whenever its source is recompiled.
+    """
+
+    _outgoing: dict[Symbol, dict[Symbol, list[CallSite]]]
+    _incoming: dict[Symbol, set[Symbol]]
+    _lock: Lock
+
+    def __init__(self):
+        self._outgoing = {}
+        self._incoming = {}
+        self._lock = Lock()
+
+    def set_calls(self, caller: Symbol, calls: Iterable[tuple[Symbol, CallSite]]):
+        """Replace the calls made by the caller"""
+        outgoing: dict[Symbol, list[CallSite]] = {}
+        for callee, call_site in calls:
+            outgoing.setdefault(callee, []).append(call_site)
+
+        for call_sites in outgoing.values():
+            call_sites.sort(key=lambda call_site: call_site[0].pos)
+
+        with self._lock:
+            previous = self._outgoing.pop(caller, {})
+
+            for callee in previous.keys() - outgoing.keys():
+                if callers := self._incoming.get(callee):
+                    callers.discard(caller)
+                    if not callers:
+                        del self._incoming[callee]
+
+            for callee in outgoing.keys() - previous.keys():
+                self._incoming.setdefault(callee, set()).add(caller)
+
+            if outgoing:
+                self._outgoing[caller] = outgoing
+
+    def get_outgoing(self, caller: Symbol) -> dict[Symbol, list[CallSite]]:
+        """The callees of the caller and where the caller calls them"""
+        with self._lock:
+            return {
+                callee: list(call_sites)
+                for callee, call_sites in self._outgoing.get(caller, {}).items()
+            }
+
+    def get_incoming(self, callee: Symbol) -> dict[Symbol, list[CallSite]]:
+        """The callers of the callee and where they call it, in their own sources"""
+        with self._lock:
+            return {
+                caller: list(self._outgoing[caller][callee])
+                for caller in self._incoming.get(callee, ())
+            }
+
+    def reachable(
+        self,
+        start: Symbol,
+        incoming: bool = False,
+        expand: Callable[[Symbol], Iterable[Symbol]] | None = None,
+    ) -> set[Symbol]:
+        """
+        Every symbol transitively called by the start symbol, or calling it if incoming.
+        `expand` lets a symbol stand for others, like a tag for the functions it runs.
+        """
+        seen = {start}
+        pending = deque([start])
+
+        with self._lock:
+            while pending:
+                symbol = pending.popleft()
+
+                if incoming:
+                    neighbours = list(self._incoming.get(symbol, ()))
+                else:
+                    neighbours = list(self._outgoing.get(symbol, ()))
+
+                if expand is not None:
+                    neighbours.extend(
+                        expanded
+                        for neighbour in list(neighbours)
+                        for expanded in expand(neighbour)
+                    )
+
+                for neighbour in neighbours:
+                    if neighbour not in seen:
+                        seen.add(neighbour)
+                        pending.append(neighbour)
+
+        seen.discard(start)
+        return seen
+
+    def __len__(self) -> int:
+        return len(self._outgoing)
@@ -1,26 +1,208 @@
+from array import array
+from contextlib import contextmanager
 from heapq import heapify
 import logging
 import re
+import sys
 from dataclasses import dataclass, field
+from enum import Enum
+from functools import partial
 from pathlib import Path
 from threading import Lock
-from typing import ClassVar
+from typing import (
+    Any,
+    Callable,
+    ClassVar,
+    Generic,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    TypeVar,
+)
 
-from beet import Context, File, Function, NamespaceFile
+from beet import Context, File, Function, FunctionTag, NamespaceFile
 from beet.core.utils import extra_field, required_field
 from bolt import Module
 from mecha import Mecha
 from tokenstream import SourceLocation
 
-__all__ = ["FilePointer", "ResourceIndex", "AegisProjectIndex"]
+from .calls import CallGraph
+from .symbols import Symbol, SymbolIndex
+from .tags import TagIndex
+
+__all__ = [
+    "CALLEES",
+    "CALLERS",
+    "NO_LOCATION",
+    "FilePointer",
+    "IndexChange",
+    "IndexContribution",
+    "PointerArray",
+    "ResourceTrie",
+    "ResourceMap",
+    "ResourceIndexSnapshot",
+    "ResourceIndex",
+    "ResourceStatus",
+    "AegisProjectIndex",
+]
 
 FilePointer = tuple[SourceLocation, SourceLocation]
+IndexEntry = tuple[type[NamespaceFile], str, FilePointer]
+
+# Where a source file defines itself
+NO_LOCATION: FilePointer = (SourceLocation(0, 0, 0), SourceLocation(0, 0, 0))
+
+# The resources whose sources can make calls and the ones that can be called
+CALLERS: tuple[type[NamespaceFile], ...] = (Function, Module)
+CALLEES: tuple[type[NamespaceFile], ...] = (Function, FunctionTag)
+
+T = TypeVar("T")
+
+
+@dataclass
+class IndexContribution:
+    """The definitions and references a single source file adds to the project index"""
+
+    definitions: set[IndexEntry] = field(default_factory=set)
+    references: set[IndexEntry] = field(default_factory=set)
+
+    # The span of the body of the resources defined within the source file, the calls
+    # within a body are made by the resource it defines
+    scopes: set[IndexEntry] = field(default_factory=set)
+
+    def __bool__(self) -> bool:
+        return bool(self.definitions or self.references)
+
+    def __sub__(self, other: "IndexContribution") -> "IndexContribution":
+        return IndexContribution(
+            self.definitions - other.definitions,
+            self.references - other.references,
+        )
+
+
+@dataclass
+class IndexChange:
+    """The entries a source file added to and removed from the project index"""
+
+    path: str
+    added: IndexContribution
+    removed: IndexContribution
+
+    # Resources that lost their last definition
+    undefined: list[tuple[type[NamespaceFile], str]] = field(default_factory=list)
+
+
+class PointerArray:
+    """
+    Compact storage for the pointers of a single source file.
+
+    Each pointer is flattened to six integers, the start and end positions, lines and
+    columns. The locations are only built back when the pointers are iterated.
+    """
+
+    __slots__ = ("_data", "generation")
+
+    STRIDE: ClassVar[int] = 6
+
+    _data: array
+    generation: int
+
+    def __init__(self, generation: int = 0):
+        # Signed, unknown locations are stored as -1
+        self._data = array("i")
+        self.generation = generation
+
+    def copy(self, generation: int) -> "PointerArray":
+        pointers = PointerArray(generation)
+        pointers._data = array("i", self._data)
+        return pointers
+
+    def add(self, pointer: FilePointer) -> bool:
+        """Add the pointer, returns False if it was already stored"""
+        if pointer in self:
+            return False
+
+        self._data.extend((*pointer[0], *pointer[1]))
+        return True
+
+    def remove(self, pointer: FilePointer) -> bool:
+        """Remove the pointer, returns False if it wasn't stored"""
+        if (i := self.find(pointer)) == -1:
+            return False
+
+        del self._data[i : i + self.STRIDE]
+        return True
+
+    def find(self, pointer: FilePointer) -> int:
+        flat = array("i", (*pointer[0], *pointer[1]))
+        data = self._data
+
+        # Jump between the candidates sharing the start position
+        i = -1
+        while True:
+            try:
+                i = data.index(flat[0], i + 1)
+            except ValueError:
+                return -1
+
+            if i % self.STRIDE == 0 and data[i : i + self.STRIDE] == flat:
+                return i
+
+    def __contains__(self, pointer: FilePointer) -> bool:
+        return self.find(pointer) != -1
+
+    def __iter__(self) -> Iterator[FilePointer]:
+        data = self._data
+
+        for i in range(0, len(data), self.STRIDE):
+            yield (
+                SourceLocation(data[i], data[i + 1], data[i + 2]),
+                SourceLocation(data[i + 3], data[i + 4], data[i + 5]),
+            )
+
+    def __len__(self) -> int:
+        return len(self._data) // self.STRIDE
+
+
+class ResourceStatus(Enum):
+    OK = "ok"
+
+    # Defined but never referenced
+    UNUSED = "unused"
+
+    # Referenced but never defined
+    DANGLING = "dangling"
 
 
 @dataclass
 class ResourceIndice:
-    definitions: dict[str, set[FilePointer]] = extra_field(default_factory=dict)
-    references: dict[str, set[FilePointer]] = extra_field(default_factory=dict)
+    definitions: dict[str, PointerArray] = extra_field(default_factory=dict)
+    references: dict[str, PointerArray] = extra_field(default_factory=dict)
+
+    # The number of pointers across every source
+    definition_count: int = extra_field(default=0)
+    reference_count: int = extra_field(default=0)
+
+    # The generation this indice was created in, published indices are never modified
+    generation: int = extra_field(default=0)
+
+    @property
+    def status(self) -> ResourceStatus:
+        if self.definition_count and not self.reference_count:
+            return ResourceStatus.UNUSED
+        if self.reference_count and not self.definition_count:
+            return ResourceStatus.DANGLING
+
+        return ResourceStatus.OK
+
+    def copy(self, generation: int) -> "ResourceIndice":
+        return ResourceIndice(
+            definitions=dict(self.definitions),
+            references=dict(self.references),
+            definition_count=self.definition_count,
+            reference_count=self.reference_count,
+            generation=generation,
+        )
 
     def _dump(self) -> str:
         dump = ""
@@ -37,16 +219,436 @@ class ResourceIndice:
         return dump
 
 
+class ResourceTrie:
+    """
+    Resource locations split into a tree of namespaces and path segments, used to
+    enumerate the resources under a given directory without scanning the whole index.
+
+    The trie is persistent, a node from an older generation is copied instead of
+    modified so published tries can be read while the next generation is built.
+    """
+
+    __slots__ = ("children", "resource", "generation")
+
+    children: dict[str, "ResourceTrie"]
+    resource: str | None
+    generation: int
+
+    def __init__(self, generation: int = 0):
+        self.children = {}
+        self.resource = None
+        self.generation = generation
+
+    @staticmethod
+    def split(resource_path: str) -> list[str]:
+        namespace, _, path = resource_path.partition(":")
+        return [namespace, *path.split("/")]
+
+    def writable(self, generation: int) -> "ResourceTrie":
+        if self.generation == generation:
+            return self
+
+        node = ResourceTrie(generation)
+        node.children = dict(self.children)
+        node.resource = self.resource
+        return node
+
+    def insert(self, resource_path: str, generation: int) -> "ResourceTrie":
+        """Returns the root of the trie with the resource inserted"""
+        root = node = self.writable(generation)
+
+        for segment in self.split(resource_path):
+            if child := node.children.get(segment):
+                child = child.writable(generation)
+            else:
+                child = ResourceTrie(generation)
+
+            node.children[segment] = child
+            node = child
+
+        node.resource = resource_path
+        return root
+
+    def remove(self, resource_path: str, generation: int) -> "ResourceTrie":
+        """Returns the root of the trie with the resource removed"""
+        segments = self.split(resource_path)
+
+        node = self
+        for segment in segments:
+            if not (node := node.children.get(segment)):
+                return self
+
+        # Copy the path to prune the branches left empty
+        root = self.writable(generation)
+        nodes = [root]
+        for segment in segments:
+            child = nodes[-1].children[segment].writable(generation)
+            nodes[-1].children[segment] = child
+            nodes.append(child)
+
+        nodes[-1].resource = None
+
+        for segment, parent, node in zip(
+            reversed(segments), reversed(nodes[:-1]), reversed(nodes)
+        ):
+            if node.children or node.resource is not None:
+                break
+            del parent.children[segment]
+
+        return root
+
+    def find(self, segments: Iterable[str]) -> "ResourceTrie | None":
+        node = self
+        for segment in segments:
+            if not (node := node.children.get(segment)):
+                return None
+
+        return node
+
+    def __iter__(self) -> Iterator[str]:
+        stack = [self]
+
+        while stack:
+            node = stack.pop()
+
+            if node.resource is not None:
+                yield node.resource
+
+            stack.extend(node.children.values())
+
+
+class ResourceMap(Generic[T]):
+    """
+    Persistent map keyed by resource locations or source paths, a trie over the bits
+    of the hashes of the keys.
+
+    Like the resource trie, a node from an older generation is copied instead of
+    modified. A new generation only copies the nodes leading to the entries it
+    changes, never the whole map.
+    """
+
+    __slots__ = ("children", "entries", "generation")
+
+    BITS: ClassVar[int] = 5
+    MASK: ClassVar[int] = (1 << 5) - 1
+
+    # Leaves holding more entries are split, unless the hash bits are exhausted
+    LEAF_SIZE: ClassVar[int] = 32
+    MAX_DEPTH: ClassVar[int] = 64 // 5
+
+    children: "dict[int, ResourceMap[T]] | None"
+    entries: dict[str, T]
+    generation: int
+
+    def __init__(self, generation: int = 0):
+        self.children = None
+        self.entries = {}
+        self.generation = generation
+
+    @staticmethod
+    def hash(key: str) -> int:
+        # Unsigned so shifting eventually runs out of bits
+        return hash(key) & 0xFFFFFFFFFFFFFFFF
+
+    def writable(self, generation: int) -> "ResourceMap[T]":
+        if self.generation == generation:
+            return self
+
+        node = ResourceMap(generation)
+        node.children = None if self.children is None else dict(self.children)
+        node.entries = dict(self.entries)
+        return node
+
+    def get(self, key: str, default: T | None = None) -> T | None:
+        node = self
+        bits = self.hash(key)
+
+        while node.children is not None:
+            if not (child := node.children.get(bits & self.MASK)):
+                return default
+
+            node = child
+            bits >>= self.BITS
+
+        return node.entries.get(key, default)
+
+    def set(self, key: str, value: T, generation: int) -> "ResourceMap[T]":
+        """Returns the root of the map with the value stored"""
+        root = node = self.writable(generation)
+        bits = self.hash(key)
+        depth = 0
+
+        while node.children is not None:
+            if child := node.children.get(bits & self.MASK):
+                child = child.writable(generation)
+            else:
+                child = ResourceMap(generation)
+
+            node.children[bits & self.MASK] = child
+            node = child
+            bits >>= self.BITS
+            depth += 1
+
+        node.entries[key] = value
+
+        if len(node.entries) > self.LEAF_SIZE and depth < self.MAX_DEPTH:
+            node.split(depth)
+
+        return root
+
+    def split(self, depth: int):
+        self.children = {}
+
+        for key, value in self.entries.items():
+            index = (self.hash(key) >> (self.BITS * depth)) & self.MASK
+
+            if not (child := self.children.get(index)):
+                child = self.children[index] = ResourceMap(self.generation)
+
+            child.entries[key] = value
+
+        self.entries = {}
+
+    def remove(self, key: str, generation: int) -> "ResourceMap[T]":
+        """Returns the root of the map with the key removed"""
+        if self.get(key) is None:
+            return self
+
+        bits = self.hash(key)
+        indices = []
+
+        # Copy the path to prune the branches left empty
+        root = self.writable(generation)
+        nodes = [root]
+        while (children := nodes[-1].children) is not None:
+            child = children[bits & self.MASK].writable(generation)
+            children[bits & self.MASK] = child
+            indices.append(bits & self.MASK)
+            nodes.append(child)
+            bits >>= self.BITS
+
+        del nodes[-1].entries[key]
+
+        for index, parent, node in zip(
+            reversed(indices), reversed(nodes[:-1]), reversed(nodes)
+        ):
+            if node.children or node.entries:
+                break
+            del parent.children[index]  # type: ignore
+
+        return root
+
+    def items(self) -> Iterator[tuple[str, T]]:
+        stack = [self]
+
+        while stack:
+            node = stack.pop()
+            yield from node.entries.items()
+
+            if node.children is not None:
+                stack.extend(node.children.values())
+
+    def keys(self) -> Iterator[str]:
+        for key, _ in self.items():
+            yield key
+
+    def __iter__(self) -> Iterator[str]:
+        return self.keys()
+
+
+class ResourceIndexSnapshot(NamedTuple):
+    """An immutable generation of a resource index"""
+
+    files: ResourceMap[ResourceIndice]
+    trie: ResourceTrie
+    generation: int
+
+    # Maps a source path to the resources it defines
+    defined: ResourceMap[frozenset[str]]
+
+
+def get_callers(contribution: IndexContribution) -> set[Symbol]:
+    """The resources the source file of the contribution defines that can make calls,
+    itself and the functions nested in it"""
+    return {
+        (resource, file)
+        for resource, file, _ in contribution.definitions
+        if resource in CALLERS
+    }
+
+
+def get_calls(
+    contribution: IndexContribution,
+) -> dict[Symbol, list[tuple[Symbol, FilePointer]]]:
+    """The calls of the source file grouped by the innermost caller containing them.
+    A nested function is called where it is defined."""
+    callers = get_callers(contribution)
+    calls: dict[Symbol, list[tuple[Symbol, FilePointer]]] = {
+        caller: [] for caller in callers
+    }
+
+    # Outside of the nested bodies the calls are made by the source file itself
+    outer = [
+        (resource, file)
+        for resource, file, location in contribution.definitions
+        if resource in CALLERS and location == NO_LOCATION
+    ]
+
+    # Bodies are nested in the ones starting before them
+    scopes = sorted(
+        (
+            (position(location[0]), position(location[1]), (resource, file))
+            for resource, file, location in contribution.scopes
+            if (resource, file) in callers
+        ),
+        key=lambda scope: scope[0],
+    )
+
+    def enclosing(location: FilePointer, caller: Symbol | None = None) -> list[Symbol]:
+        start, end = position(location[0]), position(location[1])
+
+        for scope_start, scope_end, symbol in reversed(scopes):
+            if symbol != caller and scope_start <= start and end <= scope_end:
+                return [symbol]
+
+        return outer
+
+    for resource, file, location in contribution.references:
+        if resource in CALLEES:
+            for caller in enclosing(location):
+                calls[caller].append(((resource, file), location))
+
+    for resource, file, location in contribution.definitions:
+        if resource in CALLEES and location != NO_LOCATION:
+            for caller in enclosing(location, (resource, file)):
+                calls.setdefault(caller, []).append(((resource, file), location))
+
+    return calls
+
+
+def position(location: SourceLocation) -> tuple[int, int]:
+    return (location.lineno, location.colno)
+
+
 def valid_resource_location(path: str):
     return bool(re.match(r"^[a-z0-9_\.]+:[a-z0-9_\.]+(\/?[a-z0-9_\.]+)*$", path))
 
 
 @dataclass
 class ResourceIndex:
-    _files: dict[str, ResourceIndice] = extra_field(default_factory=dict)
+    """
+    Index of the definitions and references of a resource type.
+
+    Writers build the next generation under the lock, copying what they change from
+    the published one. Readers use the last published snapshot and never take the lock.
+    """
+
+    _files: ResourceMap[ResourceIndice] = extra_field(default_factory=ResourceMap)
     _lock: Lock = extra_field(default_factory=Lock)
 
+    # Maps a source path to the resources it defines or references
+    _sources: dict[str, set[str]] = extra_field(default_factory=dict)
+
+    _trie: ResourceTrie = extra_field(default_factory=ResourceTrie)
+    _defined: ResourceMap[frozenset[str]] = extra_field(default_factory=ResourceMap)
+
+    # Called when a resource gains its first definition or loses its last one
+    _on_defined: Callable[[str], Any] | None = extra_field(default=None)
+    _on_undefined: Callable[[str], Any] | None = extra_field(default=None)
+
+    # Called when a change affects a resource that is or was unused or dangling, once
+    # the change is published so the status can be read from the snapshot
+    _on_status_changed: Callable[..., Any] | None = extra_field(default=None)
+    _status_changes: set[str] = extra_field(default_factory=set)
+
+    # The generation being built, everything stamped with it is private to the writers
+    _generation: int = extra_field(default=1)
+    _files_generation: int = extra_field(default=0)
+    _batch_depth: int = extra_field(default=0)
+
+    _published: ResourceIndexSnapshot = extra_field(
+        default_factory=lambda: ResourceIndexSnapshot(
+            ResourceMap(), ResourceTrie(), 0, ResourceMap()
+        )
+    )
+
+    @property
+    def snapshot(self) -> ResourceIndexSnapshot:
+        """The last published generation of the index"""
+        return self._published
+
+    @contextmanager
+    def batch(self):
+        """Publish the changes made within the block as a single generation"""
+        self._begin_batch()
+        try:
+            yield
+        finally:
+            self._end_batch()
+
+    def _begin_batch(self):
+        with self._lock:
+            self._batch_depth += 1
+
+    def _end_batch(self):
+        with self._lock:
+            self._batch_depth -= 1
+            self._publish()
+
+    def _publish(self):
+        if self._batch_depth > 0 or self._files_generation != self._generation:
+            return
+
+        self._published = ResourceIndexSnapshot(
+            self._files, self._trie, self._generation, self._defined
+        )
+        self._generation += 1
+
+        if self._status_changes and self._on_status_changed:
+            self._on_status_changed(*self._status_changes)
+
+        self._status_changes = set()
+
+    def _set_indice(self, resource_path: str, indice: ResourceIndice):
+        self._files = self._files.set(resource_path, indice, self._generation)
+        self._files_generation = self._generation
+
+    def _set_defined(self, source_path: str, resource_path: str, defined: bool):
+        resources = self._defined.get(source_path) or frozenset()
+
+        if defined:
+            resources = resources | {resource_path}
+        else:
+            resources = resources - {resource_path}
+
+        if resources:
+            self._defined = self._defined.set(source_path, resources, self._generation)
+        else:
+            self._defined = self._defined.remove(source_path, self._generation)
+
+    def _writable_indice(self, resource_path: str) -> ResourceIndice:
+        if not (indice := self._files.get(resource_path)):
+            indice = ResourceIndice(generation=self._generation)
+            self._set_indice(resource_path, indice)
+            self._trie = self._trie.insert(resource_path, self._generation)
+        elif indice.generation != self._generation:
+            indice = indice.copy(self._generation)
+            self._set_indice(resource_path, indice)
+
+        return indice
+
+    def _writable_pointers(
+        self, pointers: dict[str, PointerArray], source_path: str
+    ) -> PointerArray:
+        if not (locations := pointers.get(source_path)):
+            locations = pointers[source_path] = PointerArray(self._generation)
+        elif locations.generation != self._generation:
+            locations = pointers[source_path] = locations.copy(self._generation)
+
+        return locations
+
     def remove_associated(self, path: str | File) -> list[str]:
+        """Remove everything the source path added, returns the resources left undefined"""
         self._lock.acquire()
 
         if isinstance(path, File):
@@ -54,44 +656,158 @@ class ResourceIndex:
 
         removed = []
 
-        for file, indice in list(self._files.items()):
+        for file in self._sources.pop(path, ()):
+            if not (indice := self._files.get(file)):
+                continue
+
+            if path not in indice.references and path not in indice.definitions:
+                continue
+
+            status = indice.status
+            indice = self._writable_indice(file)
 
             if path in indice.references:
-                del indice.references[path]
+                indice.reference_count -= len(indice.references.pop(path))
             if path in indice.definitions:
-                del indice.definitions[path]
+                indice.definition_count -= len(indice.definitions.pop(path))
+                self._set_defined(path, file, False)
 
                 if len(indice.definitions) == 0:
-                    del self._files[file]
                     removed.append(file)
 
+                    if self._on_undefined:
+                        self._on_undefined(file)
+
+            self._notify_status(file, status, indice.status)
+            self._discard_if_empty(file, indice)
+
+        self._publish()
         self._lock.release()
         return removed
 
+    def remove_definition(
+        self, resource_path: str, source_path: str, source_location: FilePointer
+    ) -> bool:
+        """Remove a single definition, returns True if it was the last one of the resource"""
+        with self._lock:
+            undefined = self._remove_pointer(
+                resource_path, source_path, source_location, True
+            )
+            self._publish()
+
+        return undefined
+
+    def remove_reference(
+        self, resource_path: str, source_path: str, source_location: FilePointer
+    ):
+        with self._lock:
+            self._remove_pointer(resource_path, source_path, source_location, False)
+            self._publish()
+
+    def _remove_pointer(
+        self,
+        resource_path: str,
+        source_path: str,
+        source_location: FilePointer,
+        definition: bool,
+    ) -> bool:
+        if not (indice := self._files.get(resource_path)):
+            return False
+
+        pointers = indice.definitions if definition else indice.references
+        if source_location not in pointers.get(source_path, ()):
+            return False
+
+        status = indice.status
+        indice = self._writable_indice(resource_path)
+        pointers = indice.definitions if definition else indice.references
+
+        locations = self._writable_pointers(pointers, source_path)
+        locations.remove(source_location)
+
+        if definition:
+            indice.definition_count -= 1
+        else:
+            indice.reference_count -= 1
+
+        if len(locations) == 0:
+            del pointers[source_path]
+
+            if definition:
+                self._set_defined(source_path, resource_path, False)
+
+            if source_path not in indice.definitions and (
+                source_path not in indice.references
+            ):
+                sources = self._sources.get(source_path, set())
+                sources.discard(resource_path)
+                if not sources:
+                    self._sources.pop(source_path, None)
+
+        undefined = definition and len(indice.definitions) == 0
+
+        if undefined and self._on_undefined:
+            self._on_undefined(resource_path)
+
+        self._notify_status(resource_path, status, indice.status)
+        self._discard_if_empty(resource_path, indice)
+        return undefined
+
+    def _notify_status(
+        self, resource_path: str, previous: ResourceStatus, status: ResourceStatus
+    ):
+        # Changes between resources that are defined and referenced don't matter
+        if previous is ResourceStatus.OK and status is ResourceStatus.OK:
+            return
+
+        self._status_changes.add(resource_path)
+
+    def _discard_if_empty(self, resource_path: str, indice: ResourceIndice):
+        # Resources that are still referenced are kept, they just have no definition
+        if indice.definitions or indice.references:
+            return
+
+        self._files = self._files.remove(resource_path, self._generation)
+        self._files_generation = self._generation
+        self._trie = self._trie.remove(resource_path, self._generation)
+
     def add_definition(
         self,
         resource_path: str,
         source_path: str,
-        source_location: FilePointer = (
-            SourceLocation(0, 0, 0),
-            SourceLocation(0, 0, 0),
-        ),
+        source_location: FilePointer = NO_LOCATION,
     ):
         if not valid_resource_location(resource_path):
             raise Exception(f"Invalid resource location {resource_path}")
 
+        resource_path = sys.intern(resource_path)
+        source_path = sys.intern(source_path)
+
         self._lock.acquire()
 
-        indice = self._files.setdefault(resource_path, ResourceIndice())
-        locations = indice.definitions.setdefault(source_path, set())
-        locations.add(source_location)
+        indice = self._writable_indice(resource_path)
+        status = indice.status
+
+        if not indice.definitions and self._on_defined:
+            self._on_defined(resource_path)
+
+        if source_path not in indice.definitions:
+            self._set_defined(source_path, resource_path, True)
 
+        locations = self._writable_pointers(indice.definitions, source_path)
+        if locations.add(source_location):
+            indice.definition_count += 1
+            self._notify_status(resource_path, status, indice.status)
+
+        self._sources.setdefault(source_path, set()).add(resource_path)
+
+        self._publish()
         self._lock.release()
 
     def get_definitions(
         self, resource_path: str
     ) -> list[tuple[str, SourceLocation, SourceLocation]]:
-        if not (file := self._files.get(resource_path)):
+        if not (file := self._published.files.get(resource_path)):
             return []
 
         definitions = []
@@ -104,7 +820,7 @@ class ResourceIndex:
     def get_references(
         self, resource_path: str
     ) -> list[tuple[str, SourceLocation, SourceLocation]]:
-        if not (file := self._files.get(resource_path)):
+        if not (file := self._published.files.get(resource_path)):
             return []
 
         references = []
@@ -114,28 +830,93 @@ class ResourceIndex:
 
         return references
 
+    def get_source_definitions(
+        self, source_path: str
+    ) -> list[tuple[str, SourceLocation, SourceLocation]]:
+        """Returns the definitions the source path adds, without taking the lock"""
+        snapshot = self._published
+        definitions = []
+
+        for resource_path in snapshot.defined.get(source_path) or ():
+            if not (file := snapshot.files.get(resource_path)):
+                continue
+
+            for location in file.definitions.get(source_path, ()):
+                definitions.append((resource_path, *location))
+
+        return definitions
+
+    def count_definitions(self, resource_path: str) -> int:
+        if not (file := self._published.files.get(resource_path)):
+            return 0
+
+        return file.definition_count
+
+    def count_references(self, resource_path: str) -> int:
+        if not (file := self._published.files.get(resource_path)):
+            return 0
+
+        return file.reference_count
+
+    def get_status(self, resource_path: str) -> ResourceStatus:
+        if not (file := self._published.files.get(resource_path)):
+            return ResourceStatus.OK
+
+        return file.status
+
     def add_reference(
         self,
         resource_path: str,
         source_path: str,
-        source_location: FilePointer = (
-            SourceLocation(0, 0, 0),
-            SourceLocation(0, 0, 0),
-        ),
+        source_location: FilePointer = NO_LOCATION,
     ):
         if not valid_resource_location(resource_path):
             raise Exception(f"Invalid resource location {resource_path}")
 
+        resource_path = sys.intern(resource_path)
+        source_path = sys.intern(source_path)
+
         self._lock.acquire()
 
-        indice = self._files.setdefault(resource_path, ResourceIndice())
-        locations = indice.references.setdefault(source_path, set())
-        locations.add(source_location)
+        indice = self._writable_indice(resource_path)
+        status = indice.status
+
+        locations = self._writable_pointers(indice.references, source_path)
+        if locations.add(source_location):
+            indice.reference_count += 1
+            self._notify_status(resource_path, status, indice.status)
+
+        self._sources.setdefault(source_path, set()).add(resource_path)
 
+        self._publish()
         self._lock.release()
 
+    def get_associated(
+        self, path: str
+    ) -> tuple[list[tuple[str, FilePointer]], list[tuple[str, FilePointer]]]:
+        """Returns the definitions and references added by the given source path"""
+        definitions = []
+        references = []
+
+        with self._lock:
+            for file in self._sources.get(path, ()):
+                if not (indice := self._files.get(file)):
+                    continue
+
+                for location in indice.definitions.get(path, ()):
+                    definitions.append((file, location))
+                for location in indice.references.get(path, ()):
+                    references.append((file, location))
+
+        return definitions, references
+
+    def get_subtree(self, namespace: str, parent: Iterable[str] = ()) -> list[str]:
+        """Returns the resources within the namespace that are under the parent segments"""
+        node = self._published.trie.find((namespace, *parent))
+        return list(node) if node else []
+
     def __iter__(self):
-        items = self._files.keys()
+        items = self._published.files.keys()
 
         for item in items:
             yield item
@@ -143,7 +924,7 @@ class ResourceIndex:
     def _dump(self) -> str:
         dump = ""
 
-        for file, indice in self._files.items():
+        for file, indice in self._published.files.items():
             dump += f"\n- '{file}':\n"
             dump += "\t" + "\n\t".join(indice._dump().splitlines())
 
@@ -157,30 +938,207 @@ class AegisProjectIndex:
 
     resource_name_to_type: dict[str, type[NamespaceFile]] = field(default_factory=dict)
 
+    symbols: SymbolIndex = field(default_factory=SymbolIndex)
+
+    # The functions each function tag runs, including through nested tags
+    function_tags: TagIndex = field(default_factory=TagIndex)
+
+    calls: CallGraph = field(default_factory=CallGraph)
+
+    _batch_depth: int = field(default=0)
+    _batch_lock: Lock = field(default_factory=Lock)
+
+    _listeners: list[Callable[[IndexChange], Any]] = field(default_factory=list)
+
+    # Resources that are or were unused or dangling since the changes were last taken
+    _status_changes: set[Symbol] = field(default_factory=set)
+    _status_lock: Lock = field(default_factory=Lock)
+
+    # The scopes of the contribution of each source path, they aren't indexed
+    _scopes: dict[str, frozenset[IndexEntry]] = field(default_factory=dict)
+
     def __post_init__(self):
         self.resource_name_to_type = {
             t.snake_name: t for t in self._ctx.get_file_types()
         }
 
+        # Functions run by a tag are used even if nothing references them
+        self.function_tags.subscribe(partial(self._mark_status, Function))
+
     def __getitem__(self, key: type[NamespaceFile]):
-        return self._resources.setdefault(key, ResourceIndex())
+        if index := self._resources.get(key):
+            return index
 
-    def remove_associated(self, path: str):
-        for resource, index in self._resources.items():
-            removed_files = index.remove_associated(path)
+        with self._batch_lock:
+            # Keep the symbol index in sync with the definitions
+            return self._resources.setdefault(
+                key,
+                ResourceIndex(
+                    _on_defined=partial(self.symbols.add, key),
+                    _on_undefined=partial(self.symbols.remove, key),
+                    _on_status_changed=partial(self._mark_status, key),
+                    _batch_depth=self._batch_depth,
+                ),
+            )
+
+    @contextmanager
+    def batch(self):
+        """Publish the changes made to each resource type within the block at once"""
+        with self._batch_lock:
+            self._batch_depth += 1
+            for index in self._resources.values():
+                index._begin_batch()
+
+        try:
+            yield
+        finally:
+            with self._batch_lock:
+                self._batch_depth -= 1
+                for index in self._resources.values():
+                    index._end_batch()
+
+    def subscribe(self, listener: Callable[[IndexChange], Any]):
+        """Call the listener with the changes made to the index by each source file"""
+        self._listeners.append(listener)
+
+    def _mark_status(self, resource: type[NamespaceFile], *resource_paths: str):
+        with self._status_lock:
+            self._status_changes.update(
+                (resource, resource_path) for resource_path in resource_paths
+            )
+
+    def pop_status_changes(self) -> set[Symbol]:
+        """The resources whose status may have changed since the last call"""
+        with self._status_lock:
+            changes = self._status_changes
+            self._status_changes = set()
+
+        return changes
+
+    def remove_associated(self, path: str) -> IndexChange:
+        return self.set_contribution(path, IndexContribution())
+
+    def get_contribution(self, path: str) -> IndexContribution:
+        contribution = IndexContribution()
+
+        for resource, index in list(self._resources.items()):
+            definitions, references = index.get_associated(path)
+
+            contribution.definitions.update(
+                (resource, file, location) for file, location in definitions
+            )
+            contribution.references.update(
+                (resource, file, location) for file, location in references
+            )
+
+        contribution.scopes.update(self._scopes.get(path, ()))
+
+        return contribution
+
+    def set_contribution(
+        self, path: str, contribution: IndexContribution
+    ) -> IndexChange:
+        """
+        Replace what the source path contributes to the index, only the entries that
+        differ from its previous contribution are added or removed.
+        """
+        previous = self.get_contribution(path)
+        change = IndexChange(path, contribution - previous, previous - contribution)
+
+        if not change.added and not change.removed:
+            if contribution.scopes != previous.scopes:
+                self._set_scopes(path, contribution.scopes)
+                self._update_calls(previous, contribution)
+
+            return change
+
+        with self.batch():
+            for resource, file, location in change.removed.references:
+                self[resource].remove_reference(file, path, location)
+
+            for resource, file, location in change.removed.definitions:
+                if self[resource].remove_definition(file, path, location):
+                    change.undefined.append((resource, file))
+
+            for resource, file, location in change.added.definitions:
+                self[resource].add_definition(file, path, location)
+
+            for resource, file, location in change.added.references:
+                self[resource].add_reference(file, path, location)
+
+        # Definitions that only moved within the file are added back, the published
+        # snapshot can't tell while an enclosing batch is open
+        redefined = {(resource, file) for resource, file, _ in change.added.definitions}
+        change.undefined = [
+            symbol for symbol in change.undefined if symbol not in redefined
+        ]
+
+        for resource, file in change.undefined:
+            self._remove_from_packs(resource, file)
+
+        self._set_scopes(path, contribution.scopes)
+        self._update_calls(previous, contribution)
+
+        for listener in list(self._listeners):
+            listener(change)
+
+        return change
+
+    def _set_scopes(self, path: str, scopes: set[IndexEntry]):
+        if scopes:
+            self._scopes[path] = frozenset(scopes)
+        else:
+            self._scopes.pop(path, None)
+
+    def _update_calls(
+        self, previous: IndexContribution, contribution: IndexContribution
+    ):
+        calls = get_calls(contribution)
+
+        for caller in get_callers(previous) - calls.keys():
+            self.calls.set_calls(caller, ())
+
+        for caller, caller_calls in calls.items():
+            self.calls.set_calls(caller, caller_calls)
+
+    def expand_call(self, symbol: Symbol, incoming: bool = False) -> list[Symbol]:
+        """
+        The symbols a call to the symbol also stands for. A function tag runs the
+        functions in it, and a function is run wherever the tags containing it are.
+        """
+        resource, location = symbol
+
+        if incoming and resource is Function:
+            tags = self.function_tags.get_tags(location)
+            return [(FunctionTag, tag) for tag in sorted(tags)]
+
+        if not incoming and resource is FunctionTag:
+            functions = self.function_tags.expand(location)
+            return [(Function, function) for function in sorted(functions)]
+
+        return []
+
+    def get_reachable(self, symbol: Symbol, incoming: bool = False) -> set[Symbol]:
+        """Every function transitively called by the symbol, or calling it"""
+        reachable = self.calls.reachable(
+            symbol, incoming, partial(self.expand_call, incoming=incoming)
+        )
+
+        # Tags only forward the calls
+        return {symbol for symbol in reachable if symbol[0] is not FunctionTag}
 
-            for removed in removed_files:
-                for pack in self._ctx.packs:
-                    if not removed in pack[resource]:
-                        continue
+    def _remove_from_packs(self, resource: type[NamespaceFile], removed: str):
+        for pack in self._ctx.packs:
+            if not removed in pack[resource]:
+                continue
 
-                    file = pack[resource][removed]
-                    del pack[resource][removed]
+            file = pack[resource][removed]
+            del pack[resource][removed]
 
-                    mecha = self._ctx.inject(Mecha)
-                    if file in mecha.database:
-                        del mecha.database[file]
-                        self._remove_from_queue(file, mecha)
+            mecha = self._ctx.inject(Mecha)
+            if file in mecha.database:
+                del mecha.database[file]
+                self._remove_from_queue(file, mecha)
 
     def _remove_from_queue(self, file, mecha: Mecha):
         index = -1
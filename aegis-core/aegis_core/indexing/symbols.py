@@ -0,0 +1,137 @@
+import sys
+from collections import Counter
+from threading import Lock
+
+from beet import NamespaceFile
+
+__all__ = [
+    "Symbol",
+    "SymbolIndex",
+    "fuzzy_score",
+]
+
+Symbol = tuple[type[NamespaceFile], str]
+
+SEPARATORS = ":/_."
+
+
+def trigrams(text: str) -> set[str]:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def fuzzy_score(query: str, text: str) -> int | None:
+    """
+    Score how well the query matches the text as a subsequence, None if it doesn't match.
+
+    Consecutive characters and characters at the start of a segment score higher,
+    both strings are expected to be lowercase.
+    """
+    score = 0
+    position = 0
+    previous = -2
+
+    for char in query:
+        index = text.find(char, position)
+
+        if index == -1:
+            return None
+
+        score += 1
+        if index == previous + 1:
+            score += 4
+        if index == 0 or text[index - 1] in SEPARATORS:
+            score += 3
+
+        previous = index
+        position = index + 1
+
+    # Favor shorter names when the query matches equally well
+    return score * 100 - len(text)
+
+
+class SymbolIndex:
+    """
+    Fuzzy search over the resources defined in the project.
+
+    Every resource location is split into trigrams, a query only ranks the symbols that
+    share a trigram with it. Queries too short to have a trigram, or that don't share one
+    with any symbol, fall back to scanning all the symbols.
+    """
+
+    _symbols: dict[Symbol, str]
+    _trigrams: dict[str, set[Symbol]]
+    _lock: Lock
+
+    def __init__(self):
+        self._symbols = {}
+        self._trigrams = {}
+        self._lock = Lock()
+
+    def add(self, resource: type[NamespaceFile], resource_path: str):
+        symbol = (resource, sys.intern(resource_path))
+        name = resource_path.lower()
+
+        with self._lock:
+            if symbol in self._symbols:
+                return
+
+            self._symbols[symbol] = name
+            for trigram in trigrams(name):
+                self._trigrams.setdefault(trigram, set()).add(symbol)
+
+    def remove(self, resource: type[NamespaceFile], resource_path: str):
+        symbol = (resource, resource_path)
+
+        with self._lock:
+            if (name := self._symbols.pop(symbol, None)) is None:
+                return
+
+            for trigram in trigrams(name):
+                if not (symbols := self._trigrams.get(trigram)):
+                    continue
+
+                symbols.discard(symbol)
+                if not symbols:
+                    del self._trigrams[trigram]
+
+    def search(self, query: str, limit: int = 100) -> list[Symbol]:
+        """Returns the best matches for the query, ordered from best to worst"""
+        query = query.lower()
+
+        with self._lock:
+            hits = Counter(
+                symbol
+                for trigram in trigrams(query)
+                for symbol in self._trigrams.get(trigram, ())
+            )
+            candidates = {symbol: self._symbols[symbol] for symbol in hits}
+
+        ranked = self.rank(query, candidates, hits)
+
+        # The query may still match symbols that share none of its trigrams
+        if not ranked:
+            with self._lock:
+                candidates = dict(self._symbols)
+
+            ranked = self.rank(query, candidates, hits)
+
+        return ranked[:limit]
+
+    @staticmethod
+    def rank(
+        query: str, candidates: dict[Symbol, str], hits: Counter[Symbol]
+    ) -> list[Symbol]:
+        ranked = []
+
+        for symbol, name in candidates.items():
+            if (score := fuzzy_score(query, name)) is None:
+                continue
+
+            ranked.append((hits[symbol], score, symbol[1], symbol))
+
+        ranked.sort(key=lambda entry: (-entry[0], -entry[1], entry[2]))
+
+        return [symbol for *_, symbol in ranked]
+
+    def __len__(self) -> int:
+        return len(self._symbols)
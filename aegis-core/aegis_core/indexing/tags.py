@@ -0,0 +1,195 @@
+from threading import Lock
+from typing import Any, Callable, Iterable
+
+__all__ = ["TagIndex", "parse_tag_values"]
+
+
+def normalize_location(location: str) -> str:
+    return location if ":" in location else f"minecraft:{location}"
+
+
+def parse_tag_values(values: Any) -> tuple[set[str], set[str]]:
+    """Split the values of a tag file into the resources and the nested tags it lists"""
+    resources = set()
+    tags = set()
+
+    # Values that aren't a list don't list anything
+    if not isinstance(values, list):
+        return resources, tags
+
+    for value in values:
+        if isinstance(value, dict):
+            value = value.get("id")
+
+        if not isinstance(value, str) or not value:
+            continue
+
+        if value.startswith("#"):
+            tags.add(normalize_location(value[1:]))
+        else:
+            resources.add(normalize_location(value))
+
+    return resources, tags
+
+
+class TagIndex:
+    """
+    The members of the tags of the project and their transitive closure.
+
+    The closure of a tag is every resource it contains, including through the tags
+    nested in it, so expanding a tag is a single lookup. When a tag file changes only
+    the closures of that tag and of the tags including it are recomputed.
+    """
+
+    # Members listed by each tag file, a tag defined by several packs merges them
+    _sources: dict[str, dict[str, tuple[set[str], set[str]]]]
+
+    _resources: dict[str, set[str]]
+    _children: dict[str, set[str]]
+    _parents: dict[str, set[str]]
+
+    _closure: dict[str, frozenset[str]]
+    _containing: dict[str, set[str]]
+
+    _lock: Lock
+
+    # Called with the resources that entered their first tag or left their last one
+    _listeners: list[Callable[..., Any]]
+
+    def __init__(self):
+        self._sources = {}
+        self._resources = {}
+        self._children = {}
+        self._parents = {}
+        self._closure = {}
+        self._containing = {}
+        self._lock = Lock()
+        self._listeners = []
+
+    def subscribe(self, listener: Callable[..., Any]):
+        self._listeners.append(listener)
+
+    def set_tag(self, tag: str, source_path: str, values: Iterable[Any]):
+        """Replace the members the tag file at the source path lists"""
+        with self._lock:
+            sources = self._sources.setdefault(tag, {})
+            sources[source_path] = parse_tag_values(values)
+            toggled = self._update(tag)
+
+        self._notify(toggled)
+
+    def remove_tag(self, tag: str, source_path: str):
+        with self._lock:
+            if not (sources := self._sources.get(tag)):
+                return
+
+            sources.pop(source_path, None)
+            if not sources:
+                del self._sources[tag]
+
+            toggled = self._update(tag)
+
+        self._notify(toggled)
+
+    def _notify(self, resources: set[str]):
+        if not resources:
+            return
+
+        for listener in list(self._listeners):
+            listener(*resources)
+
+    def expand(self, tag: str) -> frozenset[str]:
+        """Every resource the tag contains, directly or through nested tags"""
+        return self._closure.get(tag, frozenset())
+
+    def get_tags(self, resource: str) -> set[str]:
+        """Every tag that contains the resource, directly or through nested tags"""
+        with self._lock:
+            return set(self._containing.get(resource, ()))
+
+    def get_children(self, tag: str) -> set[str]:
+        """The tags nested directly in the tag"""
+        with self._lock:
+            return set(self._children.get(tag, ()))
+
+    def _update(self, tag: str) -> set[str]:
+        resources = set()
+        children = set()
+
+        for source_resources, source_children in self._sources.get(tag, {}).values():
+            resources |= source_resources
+            children |= source_children
+
+        for child in self._children.get(tag, set()) - children:
+            if parents := self._parents.get(child):
+                parents.discard(tag)
+                if not parents:
+                    del self._parents[child]
+
+        for child in children:
+            self._parents.setdefault(child, set()).add(tag)
+
+        self._set(self._resources, tag, resources)
+        self._set(self._children, tag, children)
+
+        # Only the tag and the tags including it can see the change
+        affected = {tag}
+        pending = [tag]
+        while pending:
+            for parent in self._parents.get(pending.pop(), ()):
+                if parent not in affected:
+                    affected.add(parent)
+                    pending.append(parent)
+
+        closures = {
+            affected_tag: set(self._resources.get(affected_tag, ()))
+            for affected_tag in affected
+        }
+
+        # Grow the closures until they settle, tags can include each other
+        changed = True
+        while changed:
+            changed = False
+
+            for affected_tag, closure in closures.items():
+                size = len(closure)
+
+                for child in self._children.get(affected_tag, ()):
+                    if child in closures:
+                        closure |= closures[child]
+                    else:
+                        closure |= self._closure.get(child, frozenset())
+
+                changed = changed or len(closure) != size
+
+        moved = set()
+        for affected_tag, closure in closures.items():
+            moved |= closure ^ self._closure.get(affected_tag, frozenset())
+
+        contained = {resource for resource in moved if resource in self._containing}
+
+        for affected_tag, closure in closures.items():
+            previous = self._closure.get(affected_tag, frozenset())
+
+            for resource in previous - closure:
+                if tags := self._containing.get(resource):
+                    tags.discard(affected_tag)
+                    if not tags:
+                        del self._containing[resource]
+
+            for resource in closure - previous:
+                self._containing.setdefault(resource, set()).add(affected_tag)
+
+            self._set(self._closure, affected_tag, frozenset(closure))
+
+        # A resource moving from one tag to another is still contained
+        return contained ^ {
+            resource for resource in moved if resource in self._containing
+        }
+
+    @staticmethod
+    def _set(mapping: dict, key: str, value):
+        if value:
+            mapping[key] = value
+        else:
+            mapping.pop(key, None)
@@ -0,0 +1,202 @@
+import pytest
+from tokenstream import SourceLocation
+
+from aegis_core.indexing.project_index import (
+    NO_LOCATION,
+    FilePointer,
+    PointerArray,
+    ResourceIndex,
+    ResourceMap,
+    ResourceTrie,
+)
+
+
+def pointer(*values: int) -> FilePointer:
+    return SourceLocation(*values[:3]), SourceLocation(*values[3:])
+
+
+def build_map(count: int, generation: int = 1) -> ResourceMap[int]:
+    resources = ResourceMap[int]()
+
+    for i in range(count):
+        resources = resources.set(f"demo:function_{i}", i, generation)
+
+    return resources
+
+
+def test_map_get():
+    resources = build_map(200)
+
+    assert resources.get("demo:function_42") == 42
+    assert resources.get("demo:missing") is None
+    assert resources.get("demo:missing", 0) == 0
+    assert dict(resources.items()) == {f"demo:function_{i}": i for i in range(200)}
+
+
+def test_map_keeps_old_roots():
+    old = build_map(200)
+
+    new = old.set("demo:function_0", -1, 2)
+    new = new.set("demo:added", 200, 2)
+    new = new.remove("demo:function_1", 2)
+
+    assert new is not old
+    assert dict(old.items()) == {f"demo:function_{i}": i for i in range(200)}
+
+    assert new.get("demo:function_0") == -1
+    assert new.get("demo:added") == 200
+    assert new.get("demo:function_1") is None
+    assert len(list(new.keys())) == 200
+
+
+def test_map_writes_in_place_within_a_generation():
+    resources = build_map(10)
+
+    assert resources.set("demo:function_0", -1, 1) is resources
+    assert resources.remove("demo:function_1", 1) is resources
+    assert resources.get("demo:function_0") == -1
+
+
+def test_map_remove_missing():
+    resources = build_map(10)
+
+    assert resources.remove("demo:missing", 2) is resources
+
+
+def test_map_collapses_empty_branches():
+    old = build_map(200)
+    new = old
+
+    for i in range(200):
+        new = new.remove(f"demo:function_{i}", 2)
+
+    assert list(new.items()) == []
+    assert not new.children and not new.entries
+    assert len(list(old.items())) == 200
+
+
+def test_map_hash_collisions(monkeypatch: pytest.MonkeyPatch):
+    # The bits run out and the last leaf keeps every entry
+    monkeypatch.setattr(ResourceMap, "hash", staticmethod(lambda key: 0))
+
+    old = build_map(100)
+    new = old.remove("demo:function_5", 2)
+
+    assert dict(old.items()) == {f"demo:function_{i}": i for i in range(100)}
+    assert new.get("demo:function_5") is None
+    assert new.get("demo:function_6") == 6
+
+
+def test_trie_keeps_old_roots():
+    old = ResourceTrie().insert("demo:a/b", 1).insert("demo:a/c", 1)
+    new = old.insert("demo:a/d", 2).remove("demo:a/b", 2)
+
+    assert sorted(old) == ["demo:a/b", "demo:a/c"]
+    assert sorted(new) == ["demo:a/c", "demo:a/d"]
+
+
+def test_trie_prunes_empty_branches():
+    trie = ResourceTrie().insert("demo:a/b/c", 1).insert("other:d", 1)
+    trie = trie.remove("demo:a/b/c", 2)
+
+    assert trie.find(["demo"]) is None
+    assert list(trie) == ["other:d"]
+    assert trie.remove("demo:missing", 3) is trie
+
+
+def test_index_publishes_batches_at_once():
+    index = ResourceIndex()
+    index.add_definition("demo:a", "/a.mcfunction")
+    before = index.snapshot
+
+    with index.batch():
+        index.add_reference("demo:a", "/b.mcfunction")
+        index.add_definition("demo:b", "/b.mcfunction")
+
+        # Readers keep seeing the last published generation
+        assert index.snapshot is before
+        assert index.count_references("demo:a") == 0
+        assert index.get_definitions("demo:b") == []
+
+    assert index.snapshot is not before
+    assert index.count_references("demo:a") == 1
+    assert index.count_definitions("demo:b") == 1
+
+    # Published generations are never modified
+    assert before.files.get("demo:a").reference_count == 0  # type: ignore
+    assert before.files.get("demo:b") is None
+
+
+def test_index_removes_empty_resources():
+    index = ResourceIndex()
+    index.add_definition("demo:a/b", "/a.mcfunction")
+    index.add_reference("demo:c", "/a.mcfunction")
+    before = index.snapshot
+
+    assert index.remove_associated("/a.mcfunction") == ["demo:a/b"]
+
+    assert list(index) == []
+    assert index.get_subtree("demo") == []
+    assert index.get_source_definitions("/a.mcfunction") == []
+    assert sorted(before.files.keys()) == ["demo:a/b", "demo:c"]
+
+
+def test_pointers_add():
+    pointers = PointerArray()
+
+    assert pointers.add(pointer(1, 2, 3, 4, 5, 6))
+    assert pointers.add(pointer(7, 8, 9, 10, 11, 12))
+    assert not pointers.add(pointer(1, 2, 3, 4, 5, 6))
+
+    assert len(pointers) == 2
+    assert list(pointers) == [pointer(1, 2, 3, 4, 5, 6), pointer(7, 8, 9, 10, 11, 12)]
+
+
+def test_pointers_remove():
+    pointers = PointerArray()
+    pointers.add(pointer(1, 2, 3, 4, 5, 6))
+    pointers.add(pointer(7, 8, 9, 10, 11, 12))
+
+    assert pointers.remove(pointer(1, 2, 3, 4, 5, 6))
+    assert not pointers.remove(pointer(1, 2, 3, 4, 5, 6))
+
+    assert list(pointers) == [pointer(7, 8, 9, 10, 11, 12)]
+
+
+def test_pointers_match_whole_entries():
+    pointers = PointerArray()
+    pointers.add(pointer(1, 2, 3, 4, 5, 6))
+    pointers.add(pointer(7, 8, 9, 10, 11, 12))
+
+    # Spans the end of the first entry and the start of the second one
+    assert pointer(4, 5, 6, 7, 8, 9) not in pointers
+    assert pointers.add(pointer(4, 5, 6, 7, 8, 9))
+    assert len(pointers) == 3
+
+
+def test_pointers_special_locations():
+    unknown = pointer(-1, -1, -1, -1, -1, -1)
+    pointers = PointerArray()
+
+    assert pointers.add(NO_LOCATION)
+    assert pointers.add(unknown)
+
+    assert NO_LOCATION in pointers and unknown in pointers
+    assert list(pointers) == [NO_LOCATION, unknown]
+    assert all(location.unknown for location in list(pointers)[1])
+
+    assert pointers.remove(unknown)
+    assert list(pointers) == [NO_LOCATION]
+
+
+def test_pointers_copy():
+    pointers = PointerArray(1)
+    pointers.add(pointer(1, 2, 3, 4, 5, 6))
+
+    copy = pointers.copy(2)
+    copy.add(pointer(7, 8, 9, 10, 11, 12))
+    copy.remove(pointer(1, 2, 3, 4, 5, 6))
+
+    assert copy.generation == 2
+    assert list(pointers) == [pointer(1, 2, 3, 4, 5, 6)]
+    assert list(copy) == [pointer(7, 8, 9, 10, 11, 12)]
@@ -0,0 +1,85 @@
+import pytest
+
+from aegis_core.indexing.tags import TagIndex, parse_tag_values
+
+
+@pytest.fixture
+def tags():
+    return TagIndex()
+
+
+@pytest.fixture
+def toggled(tags: TagIndex):
+    calls: list[set[str]] = []
+    tags.subscribe(lambda *resources: calls.append(set(resources)))
+    return calls
+
+
+def test_parse_values():
+    values = ["foo", "#demo:bar", {"id": "demo:baz", "required": False}, "", 5]
+
+    assert parse_tag_values(values) == ({"minecraft:foo", "demo:baz"}, {"demo:bar"})
+    assert parse_tag_values(None) == (set(), set())
+    assert parse_tag_values({"values": []}) == (set(), set())
+
+
+def test_nested(tags: TagIndex):
+    tags.set_tag("demo:outer", "outer.json", ["demo:a", "#demo:inner"])
+    tags.set_tag("demo:inner", "inner.json", ["demo:b"])
+
+    assert tags.expand("demo:outer") == {"demo:a", "demo:b"}
+    assert tags.expand("demo:inner") == {"demo:b"}
+    assert tags.get_tags("demo:b") == {"demo:outer", "demo:inner"}
+    assert tags.get_children("demo:outer") == {"demo:inner"}
+
+    tags.set_tag("demo:inner", "inner.json", ["demo:c"])
+
+    assert tags.expand("demo:outer") == {"demo:a", "demo:c"}
+    assert tags.get_tags("demo:b") == set()
+
+
+def test_cycle(tags: TagIndex, toggled: list[set[str]]):
+    tags.set_tag("demo:first", "first.json", ["demo:a", "#demo:second"])
+    tags.set_tag("demo:second", "second.json", ["demo:b", "#demo:first"])
+
+    assert tags.expand("demo:first") == {"demo:a", "demo:b"}
+    assert tags.expand("demo:second") == {"demo:a", "demo:b"}
+    assert toggled == [{"demo:a"}, {"demo:b"}]
+
+    # Removing the tag breaks the cycle
+    tags.remove_tag("demo:second", "second.json")
+
+    assert tags.expand("demo:first") == {"demo:a"}
+    assert tags.expand("demo:second") == frozenset()
+    assert tags.get_tags("demo:a") == {"demo:first"}
+    assert tags.get_tags("demo:b") == set()
+    assert toggled[-1] == {"demo:b"}
+
+
+def test_moving_resource(tags: TagIndex, toggled: list[set[str]]):
+    tags.set_tag("demo:first", "first.json", ["demo:a"])
+    tags.set_tag("demo:second", "second.json", ["demo:a", "demo:b"])
+
+    assert toggled == [{"demo:a"}, {"demo:b"}]
+
+    # Still contained in the second tag
+    tags.set_tag("demo:first", "first.json", [])
+
+    assert toggled == [{"demo:a"}, {"demo:b"}]
+    assert tags.get_tags("demo:a") == {"demo:second"}
+
+    tags.remove_tag("demo:second", "second.json")
+
+    assert toggled[-1] == {"demo:a", "demo:b"}
+
+
+def test_several_sources(tags: TagIndex, toggled: list[set[str]]):
+    tags.set_tag("demo:merged", "first/merged.json", ["demo:a"])
+    tags.set_tag("demo:merged", "second/merged.json", ["demo:a", "demo:b"])
+
+    assert tags.expand("demo:merged") == {"demo:a", "demo:b"}
+
+    tags.remove_tag("demo:merged", "second/merged.json")
+
+    assert tags.expand("demo:merged") == {"demo:a"}
+    assert toggled == [{"demo:a"}, {"demo:b"}, {"demo:b"}]
@@ -8,13 +8,21 @@ from lsprotocol import types as lsp
 from . import __version__
 
 from .server import AegisServer
+from .server.background import IndexPriority
+from .server.features.call_hierarchy import (
+    get_incoming_calls,
+    get_outgoing_calls,
+    prepare_call_hierarchy,
+)
+from .server.features.code_lens import get_code_lenses
 from .server.features import hover as hover_feature
 from .server.features.completion import completion
 from .server.features.definition import get_definition
-from .server.features.diagnostics import publish_diagnostics
+from .server.features.diagnostics import publish_diagnostics, track_edits
 from .server.features.hover import get_hover
 from .server.features.references import get_references
 from .server.features.rename import rename_variable
+from .server.features.symbols import get_workspace_symbols
 from .server.features.semantics import (
     TOKEN_MODIFIERS,
     TOKEN_TYPES,
@@ -25,15 +33,31 @@ from .server.features.semantics import (
 def create_server():
     server = AegisServer("aegis-server", __version__)
 
-    @server.thread()
     @server.feature(lsp.TEXT_DOCUMENT_DID_CHANGE)
     def did_change(ls: AegisServer, params: lsp.DidChangeTextDocumentParams):
-        asyncio.run(publish_diagnostics(ls, params))
+        track_edits(ls, params)
+        ls.indexer.notify_activity()
+        ls.indexer.prioritize(params.text_document.uri, IndexPriority.RECENT)
+        ls.scheduler.schedule(
+            params.text_document.uri,
+            params.text_document.version,
+            lambda token: asyncio.run(publish_diagnostics(ls, params, token)),
+        )
 
-    @server.thread()
     @server.feature(lsp.TEXT_DOCUMENT_DID_OPEN)
     def did_open(ls: AegisServer, params: lsp.DidOpenTextDocumentParams):
-        asyncio.run(publish_diagnostics(ls, params))
+        track_edits(ls, params)
+        ls.indexer.prioritize(params.text_document.uri, IndexPriority.OPEN)
+        ls.scheduler.schedule(
+            params.text_document.uri,
+            params.text_document.version,
+            lambda token: asyncio.run(publish_diagnostics(ls, params, token)),
+            delay=0,
+        )
+
+    @server.feature(lsp.TEXT_DOCUMENT_DID_CLOSE)
+    def did_close(ls: AegisServer, params: lsp.DidCloseTextDocumentParams):
+        ls.scheduler.forget(params.text_document.uri)
 
     @server.thread()
     @server.feature(
@@ -72,6 +96,11 @@ def create_server():
     def references(ls: AegisServer, params: lsp.ReferenceParams):
         return asyncio.run(get_references(ls, params))
 
+    @server.thread()
+    @server.feature(lsp.WORKSPACE_SYMBOL)
+    def workspace_symbols(ls: AegisServer, params: lsp.WorkspaceSymbolParams):
+        return get_workspace_symbols(ls, params)
+
     @server.thread()
     @server.feature(lsp.TEXT_DOCUMENT_HOVER)
     def hover(ls: AegisServer, params: lsp.HoverParams):
@@ -82,9 +111,29 @@ def create_server():
     def rename(ls: AegisServer, params: lsp.RenameParams):
         return asyncio.run(rename_variable(ls, params))
 
+    @server.thread()
+    @server.feature(lsp.TEXT_DOCUMENT_CODE_LENS)
+    def code_lens(ls: AegisServer, params: lsp.CodeLensParams):
+        return asyncio.run(get_code_lenses(ls, params))
+
+    @server.thread()
+    @server.feature(lsp.TEXT_DOCUMENT_PREPARE_CALL_HIERARCHY)
+    def prepare_calls(ls: AegisServer, params: lsp.CallHierarchyPrepareParams):
+        return asyncio.run(prepare_call_hierarchy(ls, params))
+
+    @server.thread()
+    @server.feature(lsp.CALL_HIERARCHY_INCOMING_CALLS)
+    def incoming_calls(ls: AegisServer, params: lsp.CallHierarchyIncomingCallsParams):
+        return get_incoming_calls(ls, params)
+
+    @server.thread()
+    @server.feature(lsp.CALL_HIERARCHY_OUTGOING_CALLS)
+    def outgoing_calls(ls: AegisServer, params: lsp.CallHierarchyOutgoingCallsParams):
+        return get_outgoing_calls(ls, params)
+
     @server.command("mecha.server.dumpIndices")
     def dump(ls: AegisServer, *args):
-        for _, i in ls._instances.values():
+        for i in ls._instances.values():
             index = i.inject(AegisProjectIndex)
             ls.show_message_log(index.dump())
 
@@ -109,6 +158,23 @@ def add_arguments(parser: argparse.ArgumentParser):
         nargs="*",
         help="Sites to look for python packages",
     )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=0.15,
+        help="Seconds to wait for further edits before compiling a changed document",
+    )
+    parser.add_argument(
+        "--compile_workers",
+        type=int,
+        default=0,
+        help="Number of worker processes used to compile documents, 0 compiles in the server's process",
+    )
+    parser.add_argument(
+        "--workspace_diagnostics",
+        action="store_true",
+        help="Publish the diagnostics of every document indexed in the background",
+    )
     parser.add_argument(
         "--debug_ast",
         type=bool,
@@ -125,8 +191,11 @@ def main():
 
     aegis_server = create_server()
     hover_feature.DEBUG_AST = args.debug_ast
+    aegis_server.scheduler.delay = args.debounce
+    aegis_server.indexer.workspace_diagnostics = args.workspace_diagnostics
 
     aegis_server.set_sites(args.site if args.site is not None else [])
+    aegis_server.set_workers(args.compile_workers)
 
     if args.tcp:
         aegis_server.start_tcp(args.host, args.port)
@@ -1,17 +1,15 @@
 __all__ = ["ResourceLocationFeatureProvider"]
 
 import logging
-import os
 from pathlib import Path
-import re
-from typing import cast
+from typing import Sequence, cast
 
 from aegis_core.ast.features.provider import BaseFeatureProvider
 from aegis_core.ast.helpers import node_location_to_range
 from aegis_core.ast.metadata import ResourceLocationMetadata, retrieve_metadata
 from aegis_core.indexing.project_index import AegisProjectIndex
 import lsprotocol.types as lsp
-from beet import File, NamespaceFile
+from beet import File, Function, FunctionTag, NamespaceFile
 from mecha import AstResourceLocation
 
 from aegis_core.registry import AegisGameRegistries
@@ -41,6 +39,29 @@ def get_path(path: str) -> tuple[str | None, Path]:
         return (segments[0], Path(segments[1]))
 
 
+def relative_path(parent: Sequence[str], parts: Sequence[str]) -> tuple[str, int]:
+    """Returns the path from the parent to the resource and how many levels it goes up"""
+    common = 0
+    for parent_segment, segment in zip(parent, parts):
+        if parent_segment != segment:
+            break
+        common += 1
+
+    height_above = len(parent) - common
+    relative = "/".join([*([".."] * height_above), *parts[common:]])
+
+    return relative or ".", height_above
+
+
+def join_path(parent: str, relative: str) -> str:
+    if relative == ".":
+        return parent
+    if parent == ".":
+        return relative
+
+    return f"{parent}/{relative}"
+
+
 class ResourceLocationFeatureProvider(BaseFeatureProvider[AstResourceLocation]):
     @classmethod
     def hover(cls, params) -> lsp.Hover | None:
@@ -80,8 +101,17 @@ class ResourceLocationFeatureProvider(BaseFeatureProvider[AstResourceLocation]):
             return
 
         path = node.get_canonical_value()
+
+        if node.is_tag:
+            path = path[1:]
+
         definitions = project_index[metadata.represents].get_definitions(path)
 
+        # A function tag leads to the functions it runs
+        if metadata.represents is FunctionTag:
+            for function in sorted(project_index.function_tags.expand(path)):
+                definitions.extend(project_index[Function].get_definitions(function))
+
         return [
             lsp.LocationLink(
                 target_uri=Path(path).as_uri(),
@@ -106,8 +136,17 @@ class ResourceLocationFeatureProvider(BaseFeatureProvider[AstResourceLocation]):
             return
 
         path = node.get_canonical_value()
+
+        if node.is_tag:
+            path = path[1:]
+
         references = project_index[metadata.represents].get_references(path)
 
+        # A function is also run wherever a tag containing it is
+        if metadata.represents is Function:
+            for tag in sorted(project_index.function_tags.get_tags(path)):
+                references.extend(project_index[FunctionTag].get_references(tag))
+
         return [
             lsp.Location(Path(path).as_uri(), node_location_to_range(location))
             for path, *location in references
@@ -148,36 +187,33 @@ class ResourceLocationFeatureProvider(BaseFeatureProvider[AstResourceLocation]):
 
             items = []
 
-            for file in project_index[represents]:
-                file_path = get_path(file)
+            if resolved[0] is None:
+                return lsp.CompletionList(False, items)
 
-                if not (
-                    file_path[0] == resolved[0]
-                ):
-                    continue
-                
-                if unresolved[0]:
-                    if not file_path[1].is_relative_to(resolved_parent):
-                        continue
+            parent_parts = resolved_parent.parts
+            unresolved_prefix = f"{unresolved[0]}:" if unresolved[0] else ""
 
-                    relative = file_path[1].relative_to(resolved_parent)
-                else:
-                    relative = os.path.relpath(file_path[1], resolved_parent)
+            # Absolute paths only complete the resources under the typed parent,
+            # relative paths can climb up to anywhere in the namespace
+            candidates = project_index[represents].get_subtree(
+                resolved[0], parent_parts if unresolved[0] else ()
+            )
+
+            for file in candidates:
+                relative, height_above = relative_path(
+                    parent_parts, file.partition(":")[2].split("/")
+                )
 
                 if unresolved[0] is None and unresolved[1].name == "":
-                    new_path = "./" + str(relative)
+                    new_path = "./" + relative
                 else:
-                    new_path = str(unresolved_parent / relative)
+                    new_path = join_path(str(unresolved_parent), relative)
+
+                insert_text = (unresolved_prefix + new_path).replace("\\", "/")
 
-                insert_text = (
-                    f"{unresolved[0] + ':' if unresolved[0] else ''}{new_path}"
-                ).replace("\\", "/")
-                
                 if node.is_tag:
                     insert_text = "#" + insert_text
 
-                height_above = len(re.compile(r"\.\./").findall(str(relative)))
-
                 items.append(
                     lsp.CompletionItem(
                         label=insert_text,
@@ -1,23 +1,17 @@
-import asyncio
 import importlib
 import json
 import logging
 import os
 import sys
-import threading
-import time
 from contextlib import contextmanager
 from pathlib import Path
-from threading import Lock, Thread
-import traceback
-from typing import Generator, cast
+from typing import Generator
 from urllib import request
 from urllib.parse import unquote, urlparse
 from urllib.request import url2pathname
 
 from beet import (
     Context,
-    Function,
     NamespaceFile,
     PluginError,
     PluginImportError,
@@ -27,18 +21,22 @@ from beet import (
     locate_config,
 )
 from beet.library.base import LATEST_MINECRAFT_VERSION
-from bolt import Module
 from lsprotocol import types as lsp
 from mecha import DiagnosticErrorSummary, Mecha
 from pygls.server import LanguageServer
 from pygls.workspace import TextDocument
 
+from aegis_core.indexing.project_index import AegisProjectIndex
 from aegis_core.registry import AegisGameRegistries
 
-from .features.validate import validate_function
-from .shadows.compile_document import COMPILATION_RESULTS
+from .background import BackgroundIndexer
+from .cancellation import CancellationToken
+from .protocol import AegisProtocol
+from .scheduler import DocumentScheduler
+from .workers import CompilationWorkers
 from .shadows.context import LanguageServerContext
 from .shadows.project_builder import ProjectBuilderShadow
+from .snapshot import IndexSnapshot
 
 logging.basicConfig(
     filename="mecha.log",
@@ -51,53 +49,71 @@ CONFIG_TYPES = ["beet.json", "beet.yaml", "beet.yml"]
 
 
 class AegisServer(LanguageServer):
-    _instances: dict[Path, tuple[Lock, LanguageServerContext]] = dict()
+    _instances: dict[Path, LanguageServerContext] = dict()
     _sites: list[str] = []
-    _index_thread: Thread
     _alive: bool = True
 
+    scheduler: DocumentScheduler
+    indexer: BackgroundIndexer
+    workers: CompilationWorkers | None = None
+
+    # The last diagnostics of the compilations and of the project index, by uri
+    _compile_diagnostics: dict[str, list[lsp.Diagnostic]]
+    _index_diagnostics: dict[str, list[lsp.Diagnostic]]
+
     def set_sites(self, sites: list[str]):
         self._sites = sites
 
-    def __init__(self, *args):
-        super().__init__(*args)
-        self._instances = {}
-        self._index_thread = Thread(
-            target=lambda self, parent: self.scan_functions(parent),
-            args=[self, threading.current_thread()],
-        )
-        # self._index_thread.start()
-
-    async def index_functions(self, ctx: LanguageServerContext):
-        for function, file in cast(
-            list[tuple[str, Function | Module]],
-            [*ctx.data.functions.items(), *ctx.data[Module].items()],
-        ):
-            if function not in COMPILATION_RESULTS and file.source_path:
-                self.show_message_log("indexing " + function, lsp.MessageType.Debug)
-                await validate_function(
-                    ctx, self.workspace.get_document(Path(file.source_path).as_uri())
-                )
-                break
+    def get_cancellation_token(self, params) -> CancellationToken | None:
+        """The token that is cancelled when the client cancels the request of the params"""
+        if isinstance(self.lsp, AegisProtocol):
+            return self.lsp.get_cancellation_token(params)
 
-    def scan_functions(self, parent_thread: Thread):
-        logging.info("Started Indexing Thread")
-        try:
-            while self._alive and parent_thread.is_alive():
-                for lock, ctx in self._instances.values():
-                    if not lock.acquire(blocking=False):
-                        continue
+        return None
 
-                    asyncio.run(self.index_functions(ctx))
+    def set_workers(self, count: int):
+        """Compile documents in `count` worker processes, 0 compiles in the server's process"""
+        if self.workers is not None:
+            self.workers.shutdown()
 
-                    lock.release()
-                    time.sleep(0.1)
-        except Exception as exc:
-            lock.release()
-            tb = "\n".join(traceback.format_tb(exc.__traceback__))
-            logging.error(f"Fatal error occured while indexing function!\n{exc}\n{tb}")
+        self.workers = CompilationWorkers(count, self._sites) if count > 0 else None
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("protocol_cls", AegisProtocol)
+        super().__init__(*args, **kwargs)
+        self._instances = {}
+        self.scheduler = DocumentScheduler()
+        self.indexer = BackgroundIndexer(self)
+        self._compile_diagnostics = {}
+        self._index_diagnostics = {}
+
+    def publish_diagnostics(
+        self,
+        uri: str,
+        diagnostics: list[lsp.Diagnostic] | None = None,
+        version: int | None = None,
+        **kwargs,
+    ):
+        """Publish the diagnostics of the compilation along with the ones of the index"""
+        self._compile_diagnostics[uri] = diagnostics = diagnostics or []
+
+        super().publish_diagnostics(
+            uri,
+            [*diagnostics, *self._index_diagnostics.get(uri, ())],
+            version,
+            **kwargs,
+        )
 
-        logging.info("Stopped Indexing Thread")
+    def publish_index_diagnostics(self, uri: str, diagnostics: list[lsp.Diagnostic]):
+        """Replace the diagnostics the project index reports for the document"""
+        if diagnostics:
+            self._index_diagnostics[uri] = diagnostics
+        else:
+            self._index_diagnostics.pop(uri, None)
+
+        super().publish_diagnostics(
+            uri, [*self._compile_diagnostics.get(uri, ()), *diagnostics]
+        )
 
     def load_registry(self, ctx: Context, minecraft_version: str):
         """Load the game registry from Misode's mcmeta repository"""
@@ -161,7 +177,9 @@ class AegisServer(LanguageServer):
         # logging.debug(f"Mecha created for {config_path} successfully")
         return ctx
 
-    def create_instance(self, config_path: Path) -> LanguageServerContext | None:
+    def create_instance(
+        self, config_path: Path, restore: bool = True
+    ) -> LanguageServerContext | None:
         config = load_config(config_path)
         # logging.debug(config)
         # Ensure that we aren't loading in all project files
@@ -207,6 +225,10 @@ class AegisServer(LanguageServer):
         if instance:
             self.load_registry(instance, config.minecraft)
 
+        if instance and restore:
+            # Files compiled in a previous session are known before they are opened
+            instance.inject(IndexSnapshot).restore(instance.inject(AegisProjectIndex))
+
         return instance
 
     def setup_workspaces(self):
@@ -221,7 +243,8 @@ class AegisServer(LanguageServer):
         for config_path in config_paths:
             try:
                 if config := self.create_instance(config_path):
-                    self._instances[config_path.parent] = (Lock(), config)
+                    self._instances[config_path.parent] = config
+                    self.indexer.enqueue_project(config)
             except Exception as exc:
                 logging.error(
                     f"Failed to load config at {config_path} due to the following\n{exc}"
@@ -242,9 +265,10 @@ class AegisServer(LanguageServer):
             instance = self.create_instance(config_path)
 
             if instance is not None:
-                self._instances[config_path] = (Lock(), instance)
+                self._instances[config_path] = instance
+                self.indexer.enqueue_project(instance)
 
-        return self._instances[config_path]
+        return self._instances.get(config_path)
 
     @contextmanager
     def context(
@@ -260,17 +284,24 @@ class AegisServer(LanguageServer):
 
         if len(parents) <= 0:
             yield None
+            return
 
         parents = sorted(parents, key=lambda p: len(str(p).split(os.path.sep)))
 
-        (lock, context) = self.get_instance(parents[-1])
-
-        lock.acquire()
-        yield context
-        lock.release()
+        # Requests aren't serialized here, compilations wait on the
+        # project's own compilation queue
+        yield self.get_instance(parents[-1])
 
     def _kill(self):
         self._alive = False
+        self.scheduler.cancel_all()
+        self.indexer.stop()
+
+        for ctx in self._instances.values():
+            ctx.inject(IndexSnapshot).close()
+
+        if self.workers is not None:
+            self.workers.shutdown()
 
     def shutdown(self):
         self._kill()
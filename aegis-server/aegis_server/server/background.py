@@ -0,0 +1,392 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+import traceback
+from enum import IntEnum
+from functools import partial
+from pathlib import Path
+from threading import Condition, Thread
+from typing import TYPE_CHECKING
+
+from beet import Function
+from bolt import Module
+from lsprotocol import types as lsp
+from pygls.workspace import TextDocument
+
+from .cancellation import CancellationToken
+from .dependencies import ModuleGraph
+from .features.validate import validate_function
+from .resource_status import ResourceDiagnostics
+from .shadows.compile_document import CompilationLevel
+from .shadows.context import LanguageServerContext
+
+if TYPE_CHECKING:
+    from . import AegisServer
+
+__all__ = ["BackgroundIndexer", "IndexPriority"]
+
+MAX_RECENT = 64
+FLUSH_INTERVAL = 0.5
+FLUSH_SIZE = 50
+
+
+class IndexPriority(IntEnum):
+    DEPENDENT = 0
+    OPEN = 1
+    RECENT = 2
+    WORKSPACE = 3
+
+
+class BackgroundIndexer:
+    """
+    Compiles every function and module of the loaded projects in a background thread,
+    so references and definitions are known before the documents are opened.
+
+    Documents are compiled in order of priority, the documents importing a recompiled
+    module come first, in the order given by the module graph, then the open and
+    recently edited documents.
+    The indexer waits for the user to stop typing before compiling the next document and
+    cancels the compilation in progress on every edit, the cancelled document is queued again.
+    """
+
+    ls: "AegisServer"
+    idle_delay: float
+    workspace_diagnostics: bool
+
+    _queue: list[tuple[int, int, str]]
+    _queued: dict[str, tuple[IndexPriority, str]]
+    _recent: dict[str, None]
+    _counter: itertools.count
+    _condition: Condition
+    _thread: Thread | None
+    _alive: bool
+
+    _last_activity: float
+    _current: CancellationToken | None
+
+    _progress: str | None
+    _total: int
+    _done: int
+
+    _pending_diagnostics: dict[str, tuple[list[lsp.Diagnostic], int | None]]
+    _last_flush: float
+
+    def __init__(self, ls: "AegisServer", idle_delay: float = 0.5):
+        self.ls = ls
+        self.idle_delay = idle_delay
+        self.workspace_diagnostics = False
+
+        self._queue = []
+        self._queued = {}
+        self._recent = {}
+        self._counter = itertools.count()
+        self._condition = Condition()
+        self._thread = None
+        self._alive = True
+
+        self._last_activity = 0
+        self._current = None
+
+        self._progress = None
+        self._total = 0
+        self._done = 0
+
+        self._pending_diagnostics = {}
+        self._last_flush = 0
+
+    def enqueue_project(self, ctx: LanguageServerContext):
+        """Queue every function and module of the project"""
+        open_documents = self._open_documents()
+
+        ctx.inject(ModuleGraph).on_invalidated = partial(self.enqueue_dependents, ctx)
+
+        with self._condition:
+            for file in [*ctx.data.functions.values(), *ctx.data[Module].values()]:
+                if not file.source_path:
+                    continue
+
+                path = normalize(file.source_path)
+
+                if uri := open_documents.get(path):
+                    priority = IndexPriority.OPEN
+                elif path in self._recent:
+                    priority = IndexPriority.RECENT
+                else:
+                    priority = IndexPriority.WORKSPACE
+
+                self._push(path, uri or Path(file.source_path).as_uri(), priority)
+
+            self._start()
+            self._condition.notify()
+
+    def enqueue_dependents(self, ctx: LanguageServerContext, locations: list[str]):
+        """Queue the documents that import a recompiled module, in the given order"""
+        open_documents = self._open_documents()
+
+        with self._condition:
+            for location in locations:
+                file = ctx.data[Module].get(location) or ctx.data.functions.get(
+                    location
+                )
+
+                if file is None or not file.source_path:
+                    continue
+
+                path = normalize(file.source_path)
+                uri = open_documents.get(path) or Path(file.source_path).as_uri()
+
+                self._push(path, uri, IndexPriority.DEPENDENT)
+
+            self._condition.notify()
+
+    def prioritize(self, uri: str, priority: IndexPriority):
+        """Move the document ahead in the queue if it hasn't been indexed yet"""
+        path = normalize(self.ls.workspace.get_document(uri).path)
+
+        with self._condition:
+            if priority <= IndexPriority.RECENT:
+                self._recent.pop(path, None)
+                self._recent[path] = None
+
+                while len(self._recent) > MAX_RECENT:
+                    del self._recent[next(iter(self._recent))]
+
+            # Documents that aren't queued are compiled by the scheduler
+            if path in self._queued:
+                self._push(path, uri, priority)
+                self._condition.notify()
+
+    def notify_activity(self):
+        """Postpone background compilations while the user is editing"""
+        with self._condition:
+            self._last_activity = time.monotonic()
+
+            # The running compilation holds the project's compilation queue
+            if self._current is not None:
+                self._current.cancel()
+
+    def stop(self):
+        with self._condition:
+            self._alive = False
+
+            if self._current is not None:
+                self._current.cancel()
+
+            self._condition.notify()
+
+    def _open_documents(self) -> dict[str, str]:
+        return {
+            normalize(document.path): uri
+            for uri, document in list(self.ls.workspace.text_documents.items())
+        }
+
+    def _push(self, path: str, uri: str, priority: IndexPriority):
+        if (queued := self._queued.get(path)) is not None:
+            if queued[0] <= priority:
+                return
+        else:
+            self._total += 1
+
+        # The previous entry is skipped once popped, its priority no longer matches
+        self._queued[path] = (priority, uri)
+        heapq.heappush(self._queue, (priority, next(self._counter), path))
+
+    def _start(self):
+        if self._thread is not None:
+            return
+
+        self._thread = Thread(target=self._work, name="aegis-indexer", daemon=True)
+        self._thread.start()
+
+    def _next(self) -> tuple[str, str, IndexPriority] | None:
+        while self._alive:
+            if (idle := self._last_activity + self.idle_delay - time.monotonic()) > 0:
+                self._condition.wait(idle)
+                continue
+
+            while self._queue:
+                priority, _, path = heapq.heappop(self._queue)
+
+                if (queued := self._queued.get(path)) and queued[0] == priority:
+                    del self._queued[path]
+                    return path, queued[1], priority
+
+            return None
+
+        return None
+
+    def _work(self):
+        logging.info("Started Indexing Thread")
+
+        while self._alive:
+            with self._condition:
+                if entry := self._next():
+                    path, uri, priority = entry
+                    token = CancellationToken()
+                    self._current = token
+
+            if entry is None:
+                self._finish()
+
+                with self._condition:
+                    if not self._queue and self._alive:
+                        self._condition.wait()
+
+                continue
+
+            try:
+                indexed = self._index(uri, priority, token)
+            except Exception as exc:
+                tb = "\n".join(traceback.format_tb(exc.__traceback__))
+                logging.error(f"Error occured while indexing {path}\n{exc}\n{tb}")
+                indexed = True
+
+            with self._condition:
+                self._current = None
+
+                if indexed:
+                    self._done += 1
+                elif self._alive:
+                    self._total -= 1
+                    self._push(path, uri, priority)
+
+            self._report()
+
+        logging.info("Stopped Indexing Thread")
+
+    def _index(
+        self, uri: str, priority: IndexPriority, token: CancellationToken
+    ) -> bool:
+        """Compile the document, returns False if it was cancelled and should be retried"""
+        text_doc = self.ls.workspace.get_document(uri)
+
+        # Closed documents only need to be indexed unless workspace diagnostics are enabled
+        publish = self.workspace_diagnostics or uri in self.ls.workspace.text_documents
+
+        with self.ls.context(text_doc) as ctx:
+            if ctx is None:
+                return True
+
+            resource = ctx.path_to_resource.get(normalize(text_doc.path))
+            if resource is None or not isinstance(resource[1], (Function, Module)):
+                return True
+
+            diagnostics = asyncio.run(
+                validate_function(
+                    ctx,
+                    text_doc,
+                    token,
+                    self.ls.workers,
+                    (
+                        CompilationLevel.TRANSFORMED
+                        if publish
+                        else CompilationLevel.INDEXED
+                    ),
+                )
+            )
+
+        if diagnostics is None:
+            return not token.cancelled
+
+        if publish:
+            self._publish(uri, text_doc, diagnostics)
+
+        return True
+
+    def _publish(self, uri: str, text_doc: TextDocument, diagnostics: list):
+        from .features.diagnostics import tokenstream_error_to_lsp_diag
+
+        converted = [
+            tokenstream_error_to_lsp_diag(d, type(self.ls).__name__, text_doc.filename)
+            for d in diagnostics
+        ]
+
+        with self._condition:
+            self._pending_diagnostics[uri] = (converted, text_doc.version)
+
+            flush = (
+                len(self._pending_diagnostics) >= FLUSH_SIZE
+                or time.monotonic() - self._last_flush >= FLUSH_INTERVAL
+            )
+
+        if flush:
+            self._flush()
+
+    def _flush(self):
+        with self._condition:
+            pending = self._pending_diagnostics
+            self._pending_diagnostics = {}
+            self._last_flush = time.monotonic()
+
+        for uri, (diagnostics, version) in pending.items():
+            self.ls.publish_diagnostics(uri, diagnostics, version)
+
+        self._flush_resources()
+
+    def _flush_resources(self, ready: bool = False):
+        for ctx in list(self.ls._instances.values()):
+            resource_diagnostics = ctx.inject(ResourceDiagnostics)
+
+            # The references are only complete once every document was indexed
+            if ready:
+                resource_diagnostics.ready = True
+
+            resource_diagnostics.flush()
+
+    def _report(self):
+        with self._condition:
+            total = self._total
+            done = self._done
+
+        if not self._progress:
+            self._begin()
+
+        if self._progress:
+            self.ls.progress.report(
+                self._progress,
+                lsp.WorkDoneProgressReport(
+                    message=f"{done}/{total} files",
+                    percentage=int(done * 100 / max(total, 1)),
+                ),
+            )
+
+    def _begin(self):
+        capabilities = self.ls.client_capabilities
+        if not (capabilities.window and capabilities.window.work_done_progress):
+            return
+
+        token = f"aegis-indexing-{next(self._counter)}"
+
+        try:
+            self.ls.progress.create(token).result(timeout=5)
+        except Exception as exc:
+            logging.debug(f"Client refused the indexing progress\n{exc}")
+            return
+
+        self.ls.progress.begin(
+            token, lsp.WorkDoneProgressBegin(title="Indexing", percentage=0)
+        )
+        self._progress = token
+
+    def _finish(self):
+        self._flush()
+        self._flush_resources(ready=True)
+
+        with self._condition:
+            indexed = self._done
+            self._total = 0
+            self._done = 0
+
+        if self._progress:
+            self.ls.progress.end(
+                self._progress,
+                lsp.WorkDoneProgressEnd(message=f"Indexed {indexed} files"),
+            )
+            self._progress = None
+
+
+def normalize(path: str) -> str:
+    return os.path.normcase(os.path.normpath(path))
@@ -0,0 +1,194 @@
+import hashlib
+import logging
+import os
+import pickle
+from dataclasses import dataclass
+from functools import cache
+from importlib import resources
+from pathlib import Path
+
+import bolt
+import mecha
+from mecha import AstNode
+
+from aegis_core.indexing.project_index import IndexContribution
+
+from .shadows.compile_document import CompilationError
+from .shadows.context import LanguageServerContext
+
+__all__ = [
+    "CachedCompilation",
+    "cache_version",
+    "load_cached_compilation",
+    "store_cached_compilation",
+]
+
+# Bumped when the fields of the cached compilations change
+CACHE_FORMAT = 3
+
+# The oldest entries are evicted past either limit
+MAX_ENTRIES = 4096
+MAX_SIZE = 256 * 1024 * 1024
+
+# The limits are only checked every few stores
+PRUNE_INTERVAL = 64
+
+_stores = 0
+
+
+@dataclass
+class CachedCompilation:
+    """The part of a compilation that is persisted across server restarts"""
+
+    key: str
+    ast: AstNode | None
+    diagnostics: list[CompilationError]
+    contribution: IndexContribution
+    imports: set[str]
+
+
+@cache
+def source_digest() -> str:
+    """Identifies the code of aegis itself, its version isn't bumped between changes"""
+    digest = hashlib.blake2b(digest_size=16)
+
+    # Read through the import system, the packages may be within a zipapp
+    pending = [resources.files(package) for package in ("aegis_core", "aegis_server")]
+
+    while pending:
+        entry = pending.pop()
+
+        if entry.is_dir():
+            pending.extend(sorted(entry.iterdir(), key=lambda child: child.name))
+        elif entry.name.endswith(".py"):
+            digest.update(f"{entry.name}\0".encode())
+            digest.update(entry.read_bytes())
+
+    return digest.hexdigest()
+
+
+def cache_version(ctx: LanguageServerContext) -> str:
+    """Identifies the toolchain and project config the project is compiled with"""
+    digest = hashlib.blake2b(digest_size=16)
+
+    for part in (mecha.__version__, bolt.__version__, source_digest()):
+        digest.update(part.encode())
+        digest.update(b"\0")
+
+    digest.update(ctx.project_config.json().encode())
+
+    return digest.hexdigest()
+
+
+def cache_key(ctx: LanguageServerContext, source: str) -> str:
+    """Identifies the source compiled with the current toolchain and project config"""
+    digest = hashlib.blake2b(cache_version(ctx).encode(), digest_size=16)
+    digest.update(f"{CACHE_FORMAT}\0".encode())
+    digest.update(source.encode())
+
+    return digest.hexdigest()
+
+
+def cache_directory(ctx: LanguageServerContext) -> Path:
+    """The compilations are cached along with the rest of the project's beet cache"""
+    return ctx.cache.path / "aegis" / "compilations"
+
+
+def entry_path(ctx: LanguageServerContext, path: str) -> Path:
+    # Each document has a single entry, recompiling it replaces the previous one
+    name = hashlib.blake2b(path.encode(), digest_size=16).hexdigest()
+
+    return cache_directory(ctx) / f"{name}.pickle"
+
+
+def prune_cache(directory: Path):
+    """Evict the least recently stored entries until the cache fits in its limits"""
+    entries = []
+
+    for file_path in directory.glob("*.pickle"):
+        try:
+            stat = file_path.stat()
+        except OSError:
+            continue
+
+        entries.append((stat.st_mtime, stat.st_size, file_path))
+
+    entries.sort(reverse=True)
+    size = 0
+
+    for i, (_, entry_size, file_path) in enumerate(entries):
+        size += entry_size
+
+        if i < MAX_ENTRIES and size <= MAX_SIZE:
+            continue
+
+        try:
+            file_path.unlink()
+        except OSError as exc:
+            logging.debug(f"Failed to evict cached compilation {file_path}\n{exc}")
+
+
+def load_cached_compilation(
+    ctx: LanguageServerContext, path: str, source: str
+) -> CachedCompilation | None:
+    """Load the compilation of the document if it was cached from the same source"""
+    file_path = entry_path(ctx, path)
+
+    if not file_path.exists():
+        return None
+
+    try:
+        with open(file_path, "rb") as file:
+            cached = pickle.load(file)
+    except Exception as exc:
+        logging.debug(f"Failed to load cached compilation of {path}\n{exc}")
+        return None
+
+    if not isinstance(cached, CachedCompilation) or cached.key != cache_key(
+        ctx, source
+    ):
+        return None
+
+    return cached
+
+
+def store_cached_compilation(
+    ctx: LanguageServerContext,
+    path: str,
+    source: str,
+    ast: AstNode | None,
+    diagnostics: list[CompilationError],
+    contribution: IndexContribution,
+    imports: set[str],
+):
+    """Persist the compilation of the document, skipped if it can't be pickled"""
+    global _stores
+
+    cached = CachedCompilation(
+        cache_key(ctx, source), ast, diagnostics, contribution, imports
+    )
+
+    try:
+        # Type annotations may reference objects that only exist in this process
+        data = pickle.dumps(cached)
+    except Exception as exc:
+        logging.debug(f"Compilation of {path} can't be cached\n{exc}")
+        return
+
+    file_path = entry_path(ctx, path)
+    temp_path = file_path.with_suffix(f".{os.getpid()}.tmp")
+
+    try:
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(temp_path, "wb") as file:
+            file.write(data)
+
+        os.replace(temp_path, file_path)
+    except OSError as exc:
+        logging.error(f"Failed to cache compilation of {path}\n{exc}")
+        return
+
+    _stores += 1
+    if _stores % PRUNE_INTERVAL == 0:
+        prune_cache(file_path.parent)
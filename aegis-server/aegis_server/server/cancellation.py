@@ -0,0 +1,51 @@
+import time
+from threading import Event
+
+__all__ = ["CancellationToken", "CompilationCancelled"]
+
+
+class CompilationCancelled(Exception):
+    """Raised at a checkpoint of a compilation whose token was cancelled or expired"""
+
+
+class CancellationToken:
+    """
+    Cooperatively stops a compilation. The token is checked between the steps of the
+    compilation and between the top-level commands while indexing, it can be cancelled
+    from any thread.
+    """
+
+    deadline: float | None
+
+    _event: Event
+
+    def __init__(self):
+        self.deadline = None
+        self._event = Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether the token was explicitly cancelled"""
+        return self._event.is_set()
+
+    @property
+    def expired(self) -> bool:
+        """Whether the deadline of the token has passed"""
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def expire_after(self, seconds: float):
+        """Set the deadline of the token, an earlier deadline is kept"""
+        deadline = time.monotonic() + seconds
+
+        if self.deadline is None or deadline < self.deadline:
+            self.deadline = deadline
+
+    def check(self):
+        if self.cancelled:
+            raise CompilationCancelled("Compilation was cancelled")
+
+        if self.expired:
+            raise CompilationCancelled("Compilation exceeded its deadline")
@@ -0,0 +1,173 @@
+import hashlib
+import inspect
+from collections import deque
+from threading import Lock
+from typing import Any, Callable, get_args, get_origin
+
+from beet import Context
+from bolt import CompiledModule
+
+from aegis_core.reflection import UNKNOWN_TYPE, FunctionInfo, TypeInfo
+
+from .indexing import get_type_annotation
+
+__all__ = ["ModuleGraph", "export_fingerprint"]
+
+
+def export_fingerprint(module: CompiledModule | None) -> str | None:
+    """
+    Identifies the interface the module exports to its importers, the names bound
+    at the top-level of the module and their type annotations. None when the module
+    wasn't compiled, the interface is then unknown.
+    """
+    if module is None:
+        return None
+
+    digest = hashlib.blake2b(digest_size=16)
+
+    for name, variable in sorted(module.lexical_scope.variables.items()):
+        annotation = (
+            get_type_annotation(variable.bindings[0].origin)
+            if variable.bindings
+            else UNKNOWN_TYPE
+        )
+
+        digest.update(f"{name}:{describe_annotation(annotation)}\0".encode())
+
+    return digest.hexdigest()
+
+
+def describe_annotation(annotation: Any, depth: int = 0) -> str:
+    """A description of the annotation that is the same across compilations"""
+    if depth > 8:
+        return "..."
+
+    def describe(value: Any) -> str:
+        return describe_annotation(value, depth + 1)
+
+    if annotation is UNKNOWN_TYPE:
+        return "?"
+
+    if isinstance(annotation, FunctionInfo):
+        parameters = ", ".join(
+            f"{name}: {describe(parameter.annotation)} = {describe(parameter.default)}"
+            for name, parameter in annotation.parameters
+        )
+        returns = describe(annotation.return_annotation)
+        return f"({parameters}) -> {returns} {annotation.doc!r}"
+
+    if isinstance(annotation, TypeInfo):
+        fields = ", ".join(
+            f"{name}: {describe(value)}"
+            for name, value in sorted(annotation.fields.items())
+        )
+        functions = ", ".join(
+            f"{name}{describe(value)}"
+            for name, value in sorted(annotation.functions.items())
+        )
+        return f"{{{fields}; {functions}}} {annotation.doc!r}"
+
+    if origin := get_origin(annotation):
+        return f"{describe(origin)}[{', '.join(map(describe, get_args(annotation)))}]"
+
+    if isinstance(annotation, list):
+        return f"[{', '.join(map(describe, annotation))}]"
+
+    if inspect.isclass(annotation) or inspect.isroutine(annotation):
+        name = getattr(annotation, "__qualname__", getattr(annotation, "__name__", ""))
+        return f"{getattr(annotation, '__module__', '')}.{name}"
+
+    if annotation is None or isinstance(annotation, (bool, int, float, str)):
+        return repr(annotation)
+
+    # The default representation of an object changes with its address
+    return describe(type(annotation))
+
+
+class ModuleGraph:
+    """
+    The imports between the documents of a project, recorded while indexing.
+
+    When a module is recompiled only the documents that import it, directly or
+    through other modules, have to be recompiled. They are returned in an order
+    where every module comes before the documents that import it.
+    """
+
+    ctx: Context
+
+    # Called with the dependents of a recompiled module, in the order to recompile them
+    on_invalidated: Callable[[list[str]], Any] | None
+
+    _imports: dict[str, set[str]]
+    _dependents: dict[str, set[str]]
+    _lock: Lock
+
+    def __init__(self, ctx: Context):
+        self.ctx = ctx
+        self.on_invalidated = None
+
+        self._imports = {}
+        self._dependents = {}
+        self._lock = Lock()
+
+    def update(self, location: str, imports: set[str]):
+        """Replace the modules imported by the document"""
+        with self._lock:
+            previous = self._imports.get(location, set())
+
+            for module in previous - imports:
+                if dependents := self._dependents.get(module):
+                    dependents.discard(location)
+                    if not dependents:
+                        del self._dependents[module]
+
+            for module in imports - previous:
+                self._dependents.setdefault(module, set()).add(location)
+
+            if imports:
+                self._imports[location] = set(imports)
+            else:
+                self._imports.pop(location, None)
+
+    def get_dependents(self, location: str) -> set[str]:
+        with self._lock:
+            return set(self._dependents.get(location, ()))
+
+    def get_transitive_dependents(self, location: str) -> list[str]:
+        """The documents affected by a change to the module, in topological order"""
+        with self._lock:
+            affected: dict[str, None] = {}
+            pending = deque([location])
+
+            while pending:
+                for dependent in self._dependents.get(pending.popleft(), ()):
+                    if dependent != location and dependent not in affected:
+                        affected[dependent] = None
+                        pending.append(dependent)
+
+            # Only the imports between the affected documents constrain the order
+            remaining = {
+                dependent: len(self._imports.get(dependent, set()) & affected.keys())
+                for dependent in affected
+            }
+
+            order = []
+            ready = deque(
+                dependent for dependent, count in remaining.items() if not count
+            )
+
+            while ready:
+                dependent = ready.popleft()
+                order.append(dependent)
+                del remaining[dependent]
+
+                for other in self._dependents.get(dependent, ()):
+                    if other in remaining:
+                        remaining[other] -= 1
+                        if not remaining[other]:
+                            ready.append(other)
+
+        # Documents in an import cycle are recompiled in the order they were found
+        order.extend(dependent for dependent in affected if dependent in remaining)
+
+        return order
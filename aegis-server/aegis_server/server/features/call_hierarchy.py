@@ -0,0 +1,150 @@
+import os
+from pathlib import Path
+
+from beet import FunctionTag
+from lsprotocol import types as lsp
+from mecha import AstResourceLocation
+
+from aegis_core.ast.helpers import node_location_to_range
+from aegis_core.indexing.project_index import CALLEES, CALLERS
+from aegis_core.indexing.symbols import Symbol
+
+from .. import AegisServer
+from ..indexing import AegisProjectIndex
+from .helpers import (
+    fetch_compilation_data,
+    get_node_at_position,
+    get_representation_file,
+)
+from .symbols import SYMBOL_KINDS
+
+CALL_KINDS = {**SYMBOL_KINDS, FunctionTag: lsp.SymbolKind.Event}
+
+
+def create_item(
+    project_index: AegisProjectIndex, symbol: Symbol
+) -> lsp.CallHierarchyItem | None:
+    resource, resource_path = symbol
+
+    if not (definitions := project_index[resource].get_definitions(resource_path)):
+        return None
+
+    source_path, *location = definitions[0]
+    range = node_location_to_range(location)
+
+    return lsp.CallHierarchyItem(
+        name=resource_path,
+        kind=CALL_KINDS.get(resource, lsp.SymbolKind.Function),
+        uri=Path(source_path).as_uri(),
+        range=range,
+        selection_range=range,
+        detail=resource.snake_name,
+        data={"resource": resource.snake_name, "path": resource_path},
+    )
+
+
+def resolve_item(
+    ls: AegisServer, item: lsp.CallHierarchyItem
+) -> tuple[AegisProjectIndex, Symbol] | None:
+    if not isinstance(item.data, dict):
+        return None
+
+    with ls.context(ls.workspace.get_document(item.uri)) as ctx:
+        if ctx is None:
+            return None
+
+        project_index = ctx.inject(AegisProjectIndex)
+
+    if not (resource := project_index.resource_name_to_type.get(item.data["resource"])):
+        return None
+
+    return project_index, (resource, item.data["path"])
+
+
+async def prepare_call_hierarchy(
+    ls: AegisServer, params: lsp.CallHierarchyPrepareParams
+) -> list[lsp.CallHierarchyItem] | None:
+    compiled_doc = await fetch_compilation_data(ls, params)
+
+    if compiled_doc is None:
+        return None
+
+    project_index = compiled_doc.ctx.inject(AegisProjectIndex)
+    symbol = None
+
+    if compiled_doc.ast is not None:
+        node = get_node_at_position(compiled_doc.ast, params.position)
+
+        if isinstance(node, AstResourceLocation) and (
+            (represents := get_representation_file(node)) in CALLEES
+        ):
+            path = node.get_canonical_value()
+            symbol = (represents, path[1:] if node.is_tag else path)
+
+    # Outside of a call the hierarchy starts at the document itself
+    if symbol is None:
+        text_doc = ls.workspace.get_document(params.text_document.uri)
+        path = os.path.normcase(os.path.normpath(text_doc.path))
+
+        resource = compiled_doc.ctx.path_to_resource.get(path)
+        if resource is None or not isinstance(resource[1], CALLERS):
+            return None
+
+        symbol = (type(resource[1]), resource[0])
+
+    if item := create_item(project_index, symbol):
+        return [item]
+
+    return None
+
+
+def get_incoming_calls(
+    ls: AegisServer, params: lsp.CallHierarchyIncomingCallsParams
+) -> list[lsp.CallHierarchyIncomingCall] | None:
+    if not (resolved := resolve_item(ls, params.item)):
+        return None
+
+    project_index, symbol = resolved
+    calls = []
+
+    for caller, call_sites in project_index.calls.get_incoming(symbol).items():
+        if item := create_item(project_index, caller):
+            calls.append(
+                lsp.CallHierarchyIncomingCall(
+                    item, [node_location_to_range(site) for site in call_sites]
+                )
+            )
+
+    # The function is also run by the tags containing it
+    for tag in project_index.expand_call(symbol, incoming=True):
+        if item := create_item(project_index, tag):
+            calls.append(lsp.CallHierarchyIncomingCall(item, [item.selection_range]))
+
+    return calls
+
+
+def get_outgoing_calls(
+    ls: AegisServer, params: lsp.CallHierarchyOutgoingCallsParams
+) -> list[lsp.CallHierarchyOutgoingCall] | None:
+    if not (resolved := resolve_item(ls, params.item)):
+        return None
+
+    project_index, symbol = resolved
+    calls = []
+
+    for callee, call_sites in project_index.calls.get_outgoing(symbol).items():
+        if item := create_item(project_index, callee):
+            calls.append(
+                lsp.CallHierarchyOutgoingCall(
+                    item, [node_location_to_range(site) for site in call_sites]
+                )
+            )
+
+    # A tag runs the functions it contains, the calls are in the tag file itself
+    for function in project_index.expand_call(symbol):
+        if item := create_item(project_index, function):
+            calls.append(
+                lsp.CallHierarchyOutgoingCall(item, [params.item.selection_range])
+            )
+
+    return calls
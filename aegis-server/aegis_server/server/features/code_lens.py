@@ -0,0 +1,73 @@
+import os
+
+from beet import Function
+from bolt import AstClassName, AstFunctionSignature, LexicalScope
+from lsprotocol import types as lsp
+
+from aegis_core.ast.helpers import node_location_to_range, node_start_to_range
+from aegis_core.indexing.project_index import NO_LOCATION, AegisProjectIndex
+
+from .. import AegisServer
+from .helpers import fetch_compilation_data
+
+
+def reference_lens(range: lsp.Range, count: int) -> lsp.CodeLens:
+    title = f"{count} reference" if count == 1 else f"{count} references"
+    return lsp.CodeLens(range, lsp.Command(title, ""))
+
+
+def get_binding_lenses(scope: LexicalScope, lenses: list[lsp.CodeLens]):
+    for variable in scope.variables.values():
+        for binding in variable.bindings:
+            if isinstance(binding.origin, (AstFunctionSignature, AstClassName)):
+                lenses.append(
+                    reference_lens(
+                        node_start_to_range(binding.origin), len(binding.references)
+                    )
+                )
+
+    for child in scope.children:
+        get_binding_lenses(child, lenses)
+
+
+async def get_code_lenses(
+    ls: AegisServer, params: lsp.CodeLensParams
+) -> list[lsp.CodeLens] | None:
+    compiled_doc = await fetch_compilation_data(ls, params)
+
+    if compiled_doc is None:
+        return None
+
+    text_doc = ls.workspace.get_document(params.text_document.uri)
+    project_index = compiled_doc.ctx.inject(AegisProjectIndex)
+
+    lenses = []
+
+    # The counts are kept by the index, no reference is materialized
+    path = os.path.normcase(os.path.normpath(text_doc.path))
+    if resource := compiled_doc.ctx.path_to_resource.get(path):
+        lenses.append(
+            reference_lens(
+                node_location_to_range(NO_LOCATION),
+                project_index[type(resource[1])].count_references(resource[0]),
+            )
+        )
+
+    # Functions defined within the document, read from the published index
+    functions = project_index[Function]
+    for file, start, end in functions.get_source_definitions(text_doc.path):
+        if (start, end) == NO_LOCATION:
+            continue
+
+        lenses.append(
+            reference_lens(
+                node_location_to_range((start, end)), functions.count_references(file)
+            )
+        )
+
+    # Only the references within the document are known for its own bindings
+    if compiled_doc.compiled_module is not None:
+        get_binding_lenses(compiled_doc.compiled_module.lexical_scope, lenses)
+
+    lenses.sort(key=lambda lens: (lens.range.start.line, lens.range.start.character))
+    return lenses
@@ -17,6 +17,7 @@ from aegis_core.ast.features.provider import CompletionParams
 from aegis_server.server.features.helpers import get_node_at_position
 
 from ...server import AegisServer
+from ..cancellation import CancellationToken
 from ..shadows.compile_document import CompilationError
 from ..shadows.context import LanguageServerContext
 from .validate import get_compilation_data
@@ -83,7 +84,9 @@ async def completion(ls: AegisServer, params: lsp.CompletionParams):
         if ctx is None:
             items = None
         else:
-            items = await get_completions(ctx, params.position, text_doc)
+            items = await get_completions(
+                ctx, params.position, text_doc, ls.get_cancellation_token(params)
+            )
 
         return items
 
@@ -92,10 +95,11 @@ async def get_completions(
     ctx: LanguageServerContext,
     pos: lsp.Position,
     text_doc: TextDocument,
+    token: CancellationToken | None = None,
 ) -> lsp.CompletionList | None:
     mecha = ctx.inject(Mecha)
 
-    if not (compiled_doc := await get_compilation_data(ctx, text_doc)):
+    if not (compiled_doc := await get_compilation_data(ctx, text_doc, token=token)):
         return None
 
     ast = compiled_doc.ast
@@ -1,4 +1,5 @@
 import logging
+import os
 import traceback
 
 import lsprotocol.types as lsp
@@ -6,6 +7,9 @@ from mecha import Diagnostic
 from tokenstream import InvalidSyntax, UnexpectedToken
 
 from .. import AegisServer
+from ..cancellation import CancellationToken
+from ..incremental import PENDING_EDITS, record_edits
+from ..resource_status import ResourceDiagnostics
 from ..shadows.compile_document import CompilationError
 from .validate import validate_function
 
@@ -36,25 +40,58 @@ def tokenstream_error_to_lsp_diag(
     )
 
 
+def track_edits(
+    ls: AegisServer,
+    params: lsp.DidOpenTextDocumentParams | lsp.DidChangeTextDocumentParams,
+):
+    """Record the edits of the document so the next compilation can reparse incrementally"""
+    text_doc = ls.workspace.get_document(params.text_document.uri)
+    path = os.path.normcase(os.path.normpath(text_doc.path))
+
+    if isinstance(params, lsp.DidChangeTextDocumentParams):
+        record_edits(path, params.content_changes)
+    else:
+        PENDING_EDITS.pop(path, None)
+
+
 async def publish_diagnostics(
     ls: AegisServer,
     params: lsp.DidOpenTextDocumentParams | lsp.DidChangeTextDocumentParams,
+    token: CancellationToken | None = None,
 ):
     text_doc = ls.workspace.get_document(params.text_document.uri)
 
+    uri = params.text_document.uri
+
     with ls.context(text_doc) as ctx:
         if not ctx:
             diagnostics = []
         else:
-            diagnostics = await validate_function(ctx, text_doc)
-            diagnostics = [
-                tokenstream_error_to_lsp_diag(d, type(ls).__name__, text_doc.filename)
-                for d in diagnostics
-            ]
+            diagnostics = await validate_function(
+                ctx,
+                text_doc,
+                token,
+                ls.workers,
+            )
+            if diagnostics is not None:
+                diagnostics = [
+                    tokenstream_error_to_lsp_diag(
+                        d, type(ls).__name__, text_doc.filename
+                    )
+                    for d in diagnostics
+                ]
+
+    # A newer version of the document will publish its own diagnostics
+    if diagnostics is None:
+        return
 
     logging.debug(f"Sending diagnostics: {diagnostics}")
 
     ls.publish_diagnostics(
-        params.text_document.uri,
+        uri,
         diagnostics,
     )
+
+    # The edit may have added or removed the last reference of a resource
+    if ctx:
+        ctx.inject(ResourceDiagnostics).flush()
@@ -3,9 +3,9 @@ from typing import Any, cast
 from beet import NamespaceFile
 from lsprotocol import types as lsp
 from mecha import AstNode, AstResourceLocation
-from tokenstream import SourceLocation
 
 from aegis_core.ast.metadata import ResourceLocationMetadata, retrieve_metadata
+from aegis_core.ast.node_index import get_node_index
 
 from .. import AegisServer
 from .validate import get_compilation_data
@@ -26,35 +26,23 @@ def get_representation_file(node: AstResourceLocation):
     return represents
 
 
-async def fetch_compilation_data(ls: AegisServer, params: Any):
+async def fetch_compilation_data(
+    ls: AegisServer, params: Any, require_module: bool = False
+):
     text_doc = ls.workspace.get_document(params.text_document.uri)
     with ls.context(text_doc) as ctx:
 
         if ctx is None:
             return None
 
-        compiled_doc = await get_compilation_data(ctx, text_doc)
+        compiled_doc = await get_compilation_data(
+            ctx,
+            text_doc,
+            require_module,
+            token=ls.get_cancellation_token(params),
+        )
         return compiled_doc
 
 
 def get_node_at_position(root: AstNode, pos: lsp.Position):
-    target = SourceLocation(0, pos.line + 1, pos.character + 1)
-    nearest_node = root
-    for node in root.walk():
-        start = node.location
-        end = node.end_location
-
-        if not (start.colno <= target.colno and end.colno >= target.colno):
-            continue
-
-        if not (start.lineno == target.lineno and end.lineno == target.lineno):
-            continue
-
-        if (
-            start.pos >= nearest_node.location.pos
-            and end.pos <= nearest_node.end_location.pos
-        ):
-            nearest_node = node
-
-    return nearest_node
-
+    return get_node_index(root).at(pos.line + 1, pos.character + 1)
@@ -13,7 +13,7 @@ from .helpers import (
 
 
 async def rename_variable(ls: AegisServer, params: lsp.RenameParams):
-    compiled_doc = await fetch_compilation_data(ls, params)
+    compiled_doc = await fetch_compilation_data(ls, params, require_module=True)
 
     if compiled_doc is None or compiled_doc.compiled_module is None:
         return
@@ -207,7 +207,9 @@ async def semantic_tokens(ls: AegisServer, params: lsp.SemanticTokensParams):
         if ctx is None:
             data = []
         else:
-            if compiled_doc := await get_compilation_data(ctx, text_doc):
+            if compiled_doc := await get_compilation_data(
+                ctx, text_doc, token=ls.get_cancellation_token(params)
+            ):
                 ast = compiled_doc.ast
 
                 data = (
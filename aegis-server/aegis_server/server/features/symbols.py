@@ -0,0 +1,48 @@
+from pathlib import Path
+
+from beet import Advancement, Function, LootTable, NamespaceFile, Predicate
+from bolt import Module
+from lsprotocol import types as lsp
+
+from aegis_core.ast.helpers import node_location_to_range
+
+from .. import AegisServer
+from ..indexing import AegisProjectIndex
+
+SYMBOL_KINDS: dict[type[NamespaceFile], lsp.SymbolKind] = {
+    Function: lsp.SymbolKind.Function,
+    Module: lsp.SymbolKind.Module,
+    Advancement: lsp.SymbolKind.Object,
+    LootTable: lsp.SymbolKind.Object,
+    Predicate: lsp.SymbolKind.Boolean,
+}
+
+
+def get_workspace_symbols(
+    ls: AegisServer, params: lsp.WorkspaceSymbolParams
+) -> list[lsp.SymbolInformation]:
+    symbols = []
+
+    for ctx in list(ls._instances.values()):
+        project_index = ctx.inject(AegisProjectIndex)
+
+        for resource, resource_path in project_index.symbols.search(params.query):
+            definitions = project_index[resource].get_definitions(resource_path)
+
+            if len(definitions) == 0:
+                continue
+
+            source_path, *location = definitions[0]
+
+            symbols.append(
+                lsp.SymbolInformation(
+                    name=resource_path,
+                    kind=SYMBOL_KINDS.get(resource, lsp.SymbolKind.File),
+                    location=lsp.Location(
+                        Path(source_path).as_uri(), node_location_to_range(location)
+                    ),
+                    container_name=resource.snake_name,
+                )
+            )
+
+    return symbols
@@ -1,17 +1,26 @@
 import asyncio
+import json
 import logging
 import multiprocessing
 import os
 import signal
 import time
 import traceback
-from contextlib import asynccontextmanager, contextmanager
+from contextlib import contextmanager
 from dataclasses import dataclass
 from functools import partial
 from pathlib import Path, PurePath
-from typing import Any, TypeVar
-
-from beet import Context, DataPack, Function, NamespaceFile, PackLoadUrl, TextFileBase
+from typing import TYPE_CHECKING, Any, TypeVar
+
+from beet import (
+    Context,
+    DataPack,
+    Function,
+    FunctionTag,
+    NamespaceFile,
+    PackLoadUrl,
+    TextFileBase,
+)
 from beet.core.utils import extra_field, required_field
 from bolt import Module, Runtime
 from mecha import (
@@ -39,63 +48,128 @@ from mecha.contrib.nested_location import (
 from pygls.workspace import TextDocument
 from tokenstream import InvalidSyntax, SourceLocation, TokenStream
 
+from aegis_core.indexing.project_index import IndexContribution
+
+from ..cache import load_cached_compilation, store_cached_compilation
+from ..cancellation import CancellationToken, CompilationCancelled
+from ..dependencies import ModuleGraph, export_fingerprint
+from ..incremental import EditRegion, relocate, reparse_incrementally, take_edits
 from ..indexing import AegisProjectIndex, Indexer
 from ..shadows.compile_document import (
     COMPILATION_RESULTS,
     CompilationError,
+    CompilationLevel,
     CompiledDocument,
+    compilation_key,
 )
 from ..shadows.context import LanguageServerContext
+from ..snapshot import IndexSnapshot
+
+if TYPE_CHECKING:
+    from ..workers import CompilationWorkers
 
 SUPPORTED_EXTENSIONS = [Function.extension, Module.extension]
 T = TypeVar("T", bound=AstNode)
 
 
-async def get_compilation_data(ctx: LanguageServerContext, text_doc: TextDocument):
-    await COMPILATION_LOCK.acquire()
-    COMPILATION_LOCK.release()
+async def get_compilation_data(
+    ctx: LanguageServerContext,
+    text_doc: TextDocument,
+    require_module: bool = False,
+    level: CompilationLevel = CompilationLevel.INDEXED,
+    token: CancellationToken | None = None,
+):
+    path = os.path.normcase(os.path.normpath(text_doc.path))
+
+    # Cached results are read without waiting on the compilation queue
+    resource = ctx.path_to_resource.get(path)
+    if resource and (compiled_doc := COMPILATION_RESULTS.get(resource[0])):
+        if compiled_doc.level >= level and not (
+            require_module and compiled_doc.compiled_remotely
+        ):
+            return compiled_doc
 
-    resource = ctx.path_to_resource.get(
-        os.path.normcase(os.path.normpath(text_doc.path))
+    await validate_function(
+        ctx, text_doc, token, level=level, require_module=require_module
     )
 
-    if resource and resource[0] in COMPILATION_RESULTS:
-        return COMPILATION_RESULTS[resource[0]]
-
-    await validate_function(ctx, text_doc)
+    if token is not None and token.cancelled:
+        return None
 
-    resource = resource or ctx.path_to_resource.get(text_doc.path)
+    resource = ctx.path_to_resource.get(path)
 
     if resource is None:
         return None
 
-    # logging.debug(COMPILATION_RESULTS)
-    return COMPILATION_RESULTS[resource[0]]
+    return COMPILATION_RESULTS.get(resource[0])
 
 
-COMPILATION_LOCK = asyncio.Semaphore()
-
-
-@asynccontextmanager
-async def semaphore(lock: asyncio.Semaphore):
-    await lock.acquire()
+@contextmanager
+def compilation_queue(ctx: LanguageServerContext):
+    """Wait for the project's pending compilations before compiling"""
+    ctx.compilation_lock.acquire()
     try:
         yield
-        lock.release()
-    except Exception as ex:
-        lock.release()
-        raise ex
     finally:
-        lock.release()
+        ctx.compilation_lock.release()
 
 
 async def validate_function(
-    ctx: LanguageServerContext, text_doc: TextDocument
-) -> list[CompilationError]:
-
+    ctx: LanguageServerContext,
+    text_doc: TextDocument,
+    token: CancellationToken | None = None,
+    workers: "CompilationWorkers | None" = None,
+    level: CompilationLevel = CompilationLevel.TRANSFORMED,
+    require_module: bool = False,
+) -> list[CompilationError] | None:
+    """Compile the document up to the given level, None is returned if the compilation was cancelled"""
+
+    token = token or CancellationToken()
     path = os.path.normcase(os.path.normpath(text_doc.path))
+    key = compilation_key(ctx, text_doc.source)
+
+    resource = ctx.path_to_resource.get(path)
+    if resource and (
+        cached := get_cached_result(ctx, resource[0], key, level, require_module)
+    ):
+        logging.debug(f"Reusing compilation of `{path}`")
+        return cached.diagnostics
+
+    # Documents that weren't compiled since the server started may be cached on disk,
+    # modules are compiled since their importers need the compiled module. Neither
+    # the disk cache nor the workers can provide a compiled module
+    if (
+        resource
+        and not require_module
+        and resource[0] not in COMPILATION_RESULTS
+        and isinstance(resource[1], Function)
+    ):
+        diagnostics = await restore_compilation(ctx, text_doc, resource[0], token)
+
+        if diagnostics is not None or token.cancelled:
+            return diagnostics
+
+    # Modules are compiled here, their importers need the compiled module
+    if (
+        workers is not None
+        and not require_module
+        and resource
+        and isinstance(resource[1], Function)
+    ):
+        diagnostics = await apply_remote_compilation(
+            ctx, text_doc, resource[0], workers, token
+        )
+
+        # Fallback to compiling locally if the worker couldn't
+        if diagnostics is not None or token.cancelled:
+            return diagnostics
+
     logging.debug(f"Queuing compilation of `{path}`")
-    async with semaphore(COMPILATION_LOCK):
+    with compilation_queue(ctx):
+
+        if token.cancelled:
+            logging.debug(f"Dropping cancelled compilation of `{path}`")
+            return None
 
         logging.debug(f"Starting compilation of `{path}`")
 
@@ -105,8 +179,16 @@ async def validate_function(
                 return []
 
         location, file = ctx.path_to_resource[path]
+        previous = COMPILATION_RESULTS.get(location)
+        edits = take_edits(path)
+
+        if cached := get_cached_result(ctx, location, key, level, require_module):
+            return cached.diagnostics
 
         if not isinstance(file, Function) and not isinstance(file, Module):
+            if isinstance(file, FunctionTag):
+                update_function_tag(ctx, location, path, text_doc.source)
+
             COMPILATION_RESULTS[location] = CompiledDocument(
                 ctx, location, None, [], None, None
             )
@@ -114,24 +196,203 @@ async def validate_function(
             return []
 
         try:
-            async with asyncio.timeout(10):
-                compiled_doc = await parse_function(
-                    ctx,
-                    location,
-                    text_doc.path,
-                    type(file)(text_doc.source, text_doc.path),
-                )
+            token.expire_after(10)
+            compiled_doc = await parse_function(
+                ctx,
+                location,
+                text_doc.path,
+                type(file)(text_doc.source, text_doc.path),
+                previous,
+                edits,
+                level,
+                token,
+            )
 
+            compiled_doc.cache_key = compilation_key(ctx, compiled_doc.source or "")
             COMPILATION_RESULTS[location] = compiled_doc
             res = compiled_doc.diagnostics
 
-        except TimeoutError as ex:
+            if level >= CompilationLevel.INDEXED:
+                update_dependencies(ctx, compiled_doc, previous)
+
+                contribution = ctx.inject(AegisProjectIndex).get_contribution(
+                    text_doc.path
+                )
+                ctx.inject(IndexSnapshot).update(
+                    text_doc.path, text_doc.source, contribution
+                )
+
+                if level == CompilationLevel.TRANSFORMED:
+                    store_cached_compilation(
+                        ctx,
+                        text_doc.path,
+                        text_doc.source,
+                        compiled_doc.ast,
+                        compiled_doc.diagnostics,
+                        contribution,
+                        compiled_doc.imports,
+                    )
+
+        except CompilationCancelled as ex:
+            if token.cancelled:
+                logging.debug(f"Dropping cancelled compilation of `{path}`")
+                return None
+
             logging.debug(f"Compilation took longer than 10 seconds, aborting\n{ex}")
             res = []
 
     return res
 
 
+async def apply_remote_compilation(
+    ctx: LanguageServerContext,
+    text_doc: TextDocument,
+    location: str,
+    workers: "CompilationWorkers",
+    token: CancellationToken | None = None,
+) -> list[CompilationError] | None:
+    """Compile the document in a worker process and apply the result to the project"""
+    try:
+        async with asyncio.timeout(10):
+            if not (result := await workers.compile(ctx, location, text_doc)):
+                return None
+    except TimeoutError:
+        logging.debug("Remote compilation took longer than 10 seconds, aborting")
+        return None
+
+    compiled_doc, contribution = result
+    return apply_compilation(ctx, text_doc, compiled_doc, contribution, token)
+
+
+async def restore_compilation(
+    ctx: LanguageServerContext,
+    text_doc: TextDocument,
+    location: str,
+    token: CancellationToken | None = None,
+) -> list[CompilationError] | None:
+    """Apply the compilation of the document cached on disk, None if there is none"""
+    if not (cached := load_cached_compilation(ctx, text_doc.path, text_doc.source)):
+        return None
+
+    # The annotations of the imported modules may have changed since
+    if cached.imports:
+        return None
+
+    logging.debug(f"Restoring cached compilation of `{text_doc.path}`")
+
+    compiled_doc = CompiledDocument(
+        ctx=ctx,
+        resource_location=location,
+        ast=cached.ast,
+        diagnostics=cached.diagnostics,
+        compiled_unit=None,
+        compiled_module=None,
+        source=text_doc.source,
+        compiled_remotely=True,
+        imports=cached.imports,
+    )
+
+    return apply_compilation(ctx, text_doc, compiled_doc, cached.contribution, token)
+
+
+def apply_compilation(
+    ctx: LanguageServerContext,
+    text_doc: TextDocument,
+    compiled_doc: CompiledDocument,
+    contribution: IndexContribution,
+    token: CancellationToken | None = None,
+) -> list[CompilationError] | None:
+    """Apply a compilation that was done elsewhere to the project"""
+    # Only applying the result has to wait on the project's queue
+    with compilation_queue(ctx):
+        if token is not None and token.cancelled:
+            return None
+
+        ctx.inject(AegisProjectIndex).set_contribution(text_doc.path, contribution)
+
+        previous = COMPILATION_RESULTS.get(compiled_doc.resource_location)
+
+        compiled_doc.cache_key = compilation_key(ctx, compiled_doc.source or "")
+        COMPILATION_RESULTS[compiled_doc.resource_location] = compiled_doc
+
+        update_dependencies(ctx, compiled_doc, previous)
+
+    return compiled_doc.diagnostics
+
+
+def update_dependencies(
+    ctx: LanguageServerContext,
+    compiled_doc: CompiledDocument,
+    previous: CompiledDocument | None,
+):
+    """Record the imports of the document and invalidate the documents that import it
+    if the interface it exports changed"""
+    location = compiled_doc.resource_location
+
+    graph = ctx.inject(ModuleGraph)
+    graph.update(location, compiled_doc.imports)
+
+    compiled_doc.exports = export_fingerprint(compiled_doc.compiled_module)
+
+    # Importers only read the exported bindings, nothing else can affect them. The
+    # exports of a document compiled elsewhere or that failed to compile are unknown
+    if (
+        previous is not None
+        and previous.exports is not None
+        and previous.exports == compiled_doc.exports
+    ):
+        return
+
+    for dependent in graph.get_dependents(location):
+        if dependent_doc := COMPILATION_RESULTS.get(dependent):
+            dependent_doc.cache_key = None
+
+    # The indirect dependents are only recompiled if the exports of the
+    # document they import change in turn, they are queued in case it does
+    dependents = graph.get_transitive_dependents(location)
+    if dependents and graph.on_invalidated:
+        graph.on_invalidated(dependents)
+
+
+def update_function_tag(
+    ctx: LanguageServerContext, location: str, path: str, source: str
+):
+    """Keep the members of the edited tag up to date, invalid json is ignored"""
+    try:
+        values = json.loads(source).get("values", [])
+    except (json.JSONDecodeError, AttributeError):
+        return
+
+    # Easy to hit while typing, like `"values": null`
+    if not isinstance(values, list):
+        return
+
+    ctx.inject(AegisProjectIndex).function_tags.set_tag(location, path, values)
+
+
+def get_cached_result(
+    ctx: LanguageServerContext,
+    location: str,
+    key: str,
+    level: CompilationLevel = CompilationLevel.TRANSFORMED,
+    require_module: bool = False,
+) -> CompiledDocument | None:
+    """Returns the previous compilation if it was compiled from the same source and project state
+    and went at least as far as the given level"""
+    compiled_doc = COMPILATION_RESULTS.get(location)
+
+    if (
+        compiled_doc
+        and compiled_doc.ctx is ctx
+        and compiled_doc.cache_key == key
+        and compiled_doc.level >= level
+        and not (require_module and compiled_doc.compiled_remotely)
+    ):
+        return compiled_doc
+
+    return None
+
+
 def try_to_mount_file(ctx: LanguageServerContext, file_path: str):
     """Try to mount a given file path to the context. True if the file was successfully mounted"""
 
@@ -177,6 +438,7 @@ def try_to_mount_file(ctx: LanguageServerContext, file_path: str):
             ctx.data[type(file)][location] = file
 
         logging.debug(f"Mounted {file_path} to {location}")
+        ctx.bump_generation()
         return True
     except Exception as exc:
         logging.error(f"Failed to mount {file_path}, reloading datapack,\n{exc}")
@@ -215,10 +477,26 @@ async def parse_function(
     resource_location: str,
     source_path: str,
     file_instance: Function | Module,
+    previous: CompiledDocument | None = None,
+    edits: EditRegion | None = None,
+    level: CompilationLevel = CompilationLevel.TRANSFORMED,
+    token: CancellationToken | None = None,
 ) -> CompiledDocument:
 
     start = time.time()
-    ast, errors = await compile(ctx, resource_location, source_path, file_instance)
+
+    # Readers keep seeing the previous state of the index until the compilation is done
+    with ctx.inject(AegisProjectIndex).batch():
+        ast, errors, parse_tree, imports = await compile(
+            ctx,
+            resource_location,
+            source_path,
+            file_instance,
+            previous,
+            edits,
+            level,
+            token or CancellationToken(),
+        )
     logging.debug(f"Compilation for {source_path} took {time.time() - start}s")
 
     # # Parse the stream
@@ -235,7 +513,10 @@ async def parse_function(
         compiled_unit=compilation_unit,
         compiled_module=compiled_module,
         ctx=ctx,
-        dependents=set(),
+        imports=imports,
+        source=file_instance.text,
+        parse_tree=parse_tree,
+        level=level,
     )
 
 
@@ -243,8 +524,10 @@ async def parse_function(
 def use_steps(mecha: Mecha, steps):
     initial_steps = mecha.steps
     mecha.steps = steps
-    yield
-    mecha.steps = initial_steps
+    try:
+        yield
+    finally:
+        mecha.steps = initial_steps
 
 
 async def compile(
@@ -252,25 +535,28 @@ async def compile(
     resource_location: str,
     source_path: str,
     source_file: Function | Module,
-) -> tuple[AstRoot, list[InvalidSyntax]]:
+    previous: CompiledDocument | None = None,
+    edits: EditRegion | None = None,
+    level: CompilationLevel = CompilationLevel.TRANSFORMED,
+    token: CancellationToken | None = None,
+) -> tuple[AstRoot, list[InvalidSyntax], AstRoot | None, set[str]]:
+    token = token or CancellationToken()
     mecha = ctx.inject(Mecha)
     diagnostics = []
-
-    try:
-        project_index = ctx.inject(AegisProjectIndex)
-        project_index.remove_associated(source_path)
-    except Exception as e:
-        tb = "\n".join(traceback.format_tb(e.__traceback__))
-        logging.error(f"{e}\n{tb}")
+    parse_tree = None
 
     indexer = Indexer(
         ctx=ctx,
         resource_location=resource_location,
         source_path=source_path,
         file_instance=source_file,
+        token=token,
     )
 
-    with use_steps(mecha, [indexer, mecha.lint, mecha.transform]):
+    # Only run the steps needed to reach the requested level
+    steps = [indexer, mecha.lint, mecha.transform][:level]
+
+    with use_steps(mecha, steps):
 
         # Configure the database to compile the file
         compiled_unit = CompilationUnit(
@@ -280,81 +566,139 @@ async def compile(
         database[source_file] = compiled_unit
         database.enqueue(source_file)
 
-        for step, file_instance in database.process_queue():
-            compilation_unit = mecha.database[file_instance]
-            logging.debug(f"--- Step {step} for {compilation_unit.filename} ---")
-            start = time.time()
-
-            if step < 0:
-                try:
-                    compilation_unit.source = file_instance.text
-                    # Create the token stream
-                    stream = TokenStream(
-                        source=compilation_unit.source,
-                        preprocessor=mecha.preprocessor,
-                    )
+        try:
+            for step, file_instance in database.process_queue():
+                # Checkpoint between the steps, also lets the event loop run
+                token.check()
+                await asyncio.sleep(0)
+
+                compilation_unit = mecha.database[file_instance]
+                logging.debug(f"--- Step {step} for {compilation_unit.filename} ---")
+                start = time.time()
+
+                if step < 0:
+                    try:
+                        compilation_unit.source = file_instance.text
+
+                        # Only reparse the commands touched by the edits when possible
+                        ast = None
+                        if (
+                            file_instance is source_file
+                            and previous is not None
+                            and previous.parse_tree is not None
+                            and previous.cache_key
+                            == compilation_key(ctx, compilation_unit.source)
+                        ):
+                            # Compiling the same source to a higher level than before
+                            ast = relocate(previous.parse_tree, 0, 0)
+                        elif (
+                            file_instance is source_file
+                            and edits is not None
+                            and previous is not None
+                            and previous.source is not None
+                            and previous.parse_tree is not None
+                        ):
+                            ast = reparse_incrementally(
+                                mecha,
+                                previous.source,
+                                previous.parse_tree,
+                                compilation_unit.source,
+                                edits,
+                            )
 
-                    ast = mecha.parse_stream(
-                        mecha.spec.multiline, None, AstRoot.parser, stream  # type: ignore
-                    )
+                        if ast is None:
+                            # Create the token stream
+                            stream = TokenStream(
+                                source=compilation_unit.source,
+                                preprocessor=mecha.preprocessor,
+                            )
 
-                    ast, errors = ErrorAccumulator(
-                        resource_location=resource_location,
-                        filename=compilation_unit.filename,
-                        file_instance=file_instance,
-                    ).collect(ast)
-
-                    diagnostics.extend(errors)
-
-                    compilation_unit.ast = ast
-                    mecha.database.enqueue(file_instance, 0)
-
-                except InvalidSyntax as exec:
-                    logging.error(f"Failed to parse: {exec}")
-                except KeyError as exec:
-                    tb = "\n".join(traceback.format_tb(exec.__traceback__))
-                    logging.error(f"{tb}")
-                except Exception as exec:
-                    logging.error(f"{type(exec)}: {exec}")
-
-            elif step < len(mecha.steps):
-                if not compilation_unit.ast:
-                    continue
-                step_diagnostics = DiagnosticCollection()
-                try:
-                    with mecha.steps[step].use_diagnostics(step_diagnostics):
-                        if ast := mecha.steps[step](compilation_unit.ast):
-                            if not step_diagnostics.error:
-                                compilation_unit.ast = ast
-                                mecha.database.enqueue(
-                                    key=file_instance,
-                                    step=step + 1,
-                                    priority=compilation_unit.priority,
-                                )
+                            ast = mecha.parse_stream(
+                                mecha.spec.multiline, None, AstRoot.parser, stream  # type: ignore
+                            )
+
+                        ast, errors = ErrorAccumulator(
+                            resource_location=resource_location,
+                            filename=compilation_unit.filename,
+                            file_instance=file_instance,
+                        ).collect(ast)
 
-                            compilation_unit.diagnostics.extend(step_diagnostics)
-                except McCompilationError as e:
-                    cause = e.__cause__
-                    tb = traceback.extract_tb(cause.__traceback__)[-1]
-                    logging.error(type(cause))
-                    logging.error(tb)
-
-                    if Path(tb.filename) == Path(source_path):
-                        diagnostics.append(
-                            Diagnostic(
-                                message=str(cause),
-                                level="error",
-                                location=SourceLocation(
-                                    0, tb.lineno or 0, tb.colno or 0
-                                ),
-                                end_location=SourceLocation(
-                                    0, tb.end_lineno or 0, tb.end_colno or 0
-                                ),
+                        diagnostics.extend(errors)
+
+                        if file_instance is source_file and not errors:
+                            parse_tree = ast
+
+                        compilation_unit.ast = ast
+                        mecha.database.enqueue(file_instance, 0)
+
+                    except InvalidSyntax as exec:
+                        logging.error(f"Failed to parse: {exec}")
+                    except KeyError as exec:
+                        tb = "\n".join(traceback.format_tb(exec.__traceback__))
+                        logging.error(f"{tb}")
+                    except Exception as exec:
+                        logging.error(f"{type(exec)}: {exec}")
+
+                elif step < len(mecha.steps):
+                    if not compilation_unit.ast:
+                        continue
+                    step_diagnostics = DiagnosticCollection()
+                    try:
+                        with mecha.steps[step].use_diagnostics(step_diagnostics):
+                            if ast := mecha.steps[step](compilation_unit.ast):
+                                if not step_diagnostics.error:
+                                    compilation_unit.ast = ast
+                                    mecha.database.enqueue(
+                                        key=file_instance,
+                                        step=step + 1,
+                                        priority=compilation_unit.priority,
+                                    )
+
+                                compilation_unit.diagnostics.extend(step_diagnostics)
+                    except McCompilationError as e:
+                        cause = e.__cause__
+                        tb = traceback.extract_tb(cause.__traceback__)[-1]
+                        logging.error(type(cause))
+                        logging.error(tb)
+
+                        if Path(tb.filename) == Path(source_path):
+                            diagnostics.append(
+                                Diagnostic(
+                                    message=str(cause),
+                                    level="error",
+                                    location=SourceLocation(
+                                        0, tb.lineno or 0, tb.colno or 0
+                                    ),
+                                    end_location=SourceLocation(
+                                        0, tb.end_lineno or 0, tb.end_colno or 0
+                                    ),
+                                )
                             )
-                        )
 
-                    logging.error("\n".join(traceback.format_tb(cause.__traceback__)))
+                        logging.error("\n".join(traceback.format_tb(cause.__traceback__)))
+
+                logging.debug(f"Execution took {time.time() - start}s")
+        except (CompilationCancelled, asyncio.CancelledError):
+            # The rest of the queue belongs to the cancelled compilation
+            database.queue.clear()
+            raise
+
+    # Only what changed since the previous compilation is applied to the index
+    if indexer.contribution is not None:
+        try:
+            ctx.inject(AegisProjectIndex).set_contribution(
+                source_path, indexer.contribution
+            )
+        except Exception as e:
+            tb = "\n".join(traceback.format_tb(e.__traceback__))
+            logging.error(f"{e}\n{tb}")
+
+    if level < CompilationLevel.INDEXED:
+        return (
+            compiled_unit.ast or indexer.output_ast,
+            diagnostics,
+            parse_tree,
+            indexer.imports,
+        )
 
-            logging.debug(f"Execution took {time.time() - start}s")
-            
-    return indexer.output_ast, diagnostics
+    return indexer.output_ast, diagnostics, parse_tree, indexer.imports
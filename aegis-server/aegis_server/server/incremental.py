@@ -0,0 +1,274 @@
+import logging
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, fields, replace
+from typing import Sequence, TypeVar
+
+from lsprotocol import types as lsp
+from mecha import AbstractChildren, AbstractNode, AstChildren, AstNode, AstRoot, Mecha
+from mecha.ast import AstError
+from tokenstream import SourceLocation, TokenStream
+
+from aegis_core.ast.metadata import (
+    ResourceLocationMetadata,
+    attach_metadata,
+    retrieve_metadata,
+)
+
+__all__ = [
+    "EditRegion",
+    "PENDING_EDITS",
+    "record_edits",
+    "take_edits",
+    "reparse_incrementally",
+]
+
+T = TypeVar("T", bound=AbstractNode)
+
+
+@dataclass
+class EditRegion:
+    """
+    The lines touched by a sequence of LSP content changes
+
+    Attributes
+    ----------
+    start : int
+        The first touched line (0-indexed)
+    end : int
+        The last touched line in the current document (0-indexed, inclusive)
+    delta : int
+        The number of lines added (or removed) since tracking started
+    """
+
+    start: int
+    end: int
+    delta: int = 0
+
+    @property
+    def previous_end(self) -> int:
+        """The last touched line in the document before the changes were applied"""
+        return self.end - self.delta
+
+    def extend(self, change_range: lsp.Range, text: str):
+        start = change_range.start.line
+        end = change_range.end.line
+        inserted = text.count("\n")
+        delta = inserted - (end - start)
+
+        # Map the current end of the region through the new change
+        if self.end > end:
+            current_end = self.end + delta
+        elif self.end >= start:
+            current_end = start + inserted
+        else:
+            current_end = self.end
+
+        self.start = min(self.start, start)
+        self.end = max(current_end, start + inserted)
+        self.delta += delta
+
+
+# Maps a normalized document path to the region edited since its last compilation,
+# None is used to mark a document that needs to be fully reparsed
+PENDING_EDITS: dict[str, EditRegion | None] = {}
+
+
+def record_edits(path: str, changes: Sequence[lsp.TextDocumentContentChangeEvent]):
+    """Accumulate the given content changes into the pending edits of the document"""
+    if path in PENDING_EDITS and PENDING_EDITS[path] is None:
+        return
+
+    region = PENDING_EDITS.get(path)
+
+    for change in changes:
+        if not isinstance(change, lsp.TextDocumentContentChangeEvent_Type1):
+            PENDING_EDITS[path] = None
+            return
+
+        if region is None:
+            start = change.range.start.line
+            region = EditRegion(start, start)
+
+        region.extend(change.range, change.text)
+
+    PENDING_EDITS[path] = region
+
+
+def take_edits(path: str) -> EditRegion | None:
+    """Pop the pending edits of the document, None if it has to be fully reparsed"""
+    return PENDING_EDITS.pop(path, None)
+
+
+def line_offsets(source: str) -> list[int]:
+    offsets = [0]
+    index = source.find("\n")
+
+    while index != -1:
+        offsets.append(index + 1)
+        index = source.find("\n", index + 1)
+
+    return offsets
+
+
+def offset_of_line(offsets: list[int], line: int, source: str) -> int:
+    if line < len(offsets):
+        return offsets[line]
+    return len(source)
+
+
+def shift_location(location: SourceLocation, pos: int, lines: int) -> SourceLocation:
+    if location.unknown:
+        return location
+
+    return SourceLocation(location.pos + pos, location.lineno + lines, location.colno)
+
+
+def relocate(node: T, pos: int, lines: int) -> T:
+    """
+    Rebuild the node with its locations shifted by the given offsets.
+
+    Only the metadata produced while parsing is carried over, everything else
+    is attached again when the document is indexed.
+    """
+    changes = {}
+
+    for f in fields(node):
+        attribute = getattr(node, f.name)
+
+        if isinstance(attribute, AbstractChildren):
+            changes[f.name] = type(attribute)(
+                relocate(child, pos, lines) for child in attribute
+            )
+        elif isinstance(attribute, AbstractNode):
+            changes[f.name] = relocate(attribute, pos, lines)
+
+    changes["location"] = shift_location(node.location, pos, lines)
+    changes["end_location"] = shift_location(node.end_location, pos, lines)
+
+    relocated = replace(node, **changes)
+
+    if metadata := retrieve_metadata(node, ResourceLocationMetadata):
+        attach_metadata(
+            relocated,
+            ResourceLocationMetadata(unresolved_path=metadata.unresolved_path),
+        )
+
+    return relocated
+
+
+def is_context_free(node: AstNode) -> bool:
+    """Whether the node can be reparsed without the rest of the document.
+
+    Bolt nodes depend on the lexical scope built by the commands before them."""
+    for child in node.walk():
+        if isinstance(child, AstError):
+            return False
+        if type(child).__module__.split(".")[0] == "bolt":
+            return False
+
+    return True
+
+
+def reparse_incrementally(
+    mecha: Mecha,
+    previous_source: str,
+    previous_ast: AstRoot,
+    source: str,
+    region: EditRegion,
+) -> AstRoot | None:
+    """
+    Reparse the top-level commands touched by the edited region and splice them
+    into the previous ast. None is returned if the document must be fully reparsed.
+
+    The commands before the region are reused as they are, the metadata attached to
+    them while indexing is replaced when the document is indexed again. Only the
+    commands after the region are rebuilt, and only if their locations moved.
+    """
+    commands = previous_ast.commands
+
+    # Top-level commands touching the edited lines, in the previous document
+    first = bisect_left(commands, region.start, key=lambda c: c.end_location.lineno - 1)
+    last = (
+        bisect_right(commands, region.previous_end, key=lambda c: c.location.lineno - 1)
+        - 1
+    )
+
+    start_line = region.start
+    end_line = region.previous_end
+    if first <= last:
+        start_line = min(start_line, commands[first].location.lineno - 1)
+        end_line = max(end_line, commands[last].end_location.lineno - 1)
+
+    # Commands sharing a line with the region can't be reparsed on their own
+    if first > 0 and commands[first - 1].end_location.lineno - 1 >= start_line:
+        return None
+    if last + 1 < len(commands) and commands[last + 1].location.lineno - 1 <= end_line:
+        return None
+
+    previous_offsets = line_offsets(previous_source)
+    offsets = line_offsets(source)
+
+    previous_start = offset_of_line(previous_offsets, start_line, previous_source)
+    previous_end = offset_of_line(previous_offsets, end_line + 1, previous_source)
+    start = offset_of_line(offsets, start_line, source)
+    end = offset_of_line(offsets, end_line + region.delta + 1, source)
+
+    # The edits are only a hint, make sure that everything outside
+    # of the region is actually unchanged
+    if (
+        end < start
+        or previous_start != start
+        or previous_source[:previous_start] != source[:start]
+        or previous_source[previous_end:] != source[end:]
+    ):
+        return None
+
+    fragment = source[start:end]
+    if "\\\n" in fragment:
+        return None
+
+    if not all(is_context_free(command) for command in commands[first : last + 1]):
+        return None
+
+    try:
+        stream = TokenStream(source=fragment, preprocessor=mecha.preprocessor)
+        reparsed = mecha.parse_stream(
+            mecha.spec.multiline, None, AstRoot.parser, stream  # type: ignore
+        )
+    except Exception:
+        # Without the rest of the compilation unit any parser may fail
+        return None
+
+    if not isinstance(reparsed, AstRoot) or not is_context_free(reparsed):
+        return None
+
+    pos_delta = end - previous_end
+    line_delta = region.delta
+
+    following: Sequence[AstNode] = commands[last + 1 :]
+    if pos_delta or line_delta:
+        following = [relocate(command, pos_delta, line_delta) for command in following]
+
+    spliced = AstChildren(
+        [
+            *commands[:first],
+            *(relocate(command, start, start_line) for command in reparsed.commands),
+            *following,
+        ]
+    )
+
+    end_location = shift_location(reparsed.end_location, start, start_line)
+    if previous_ast.end_location.pos >= previous_end:
+        shifted = shift_location(previous_ast.end_location, pos_delta, line_delta)
+        if shifted.pos > end_location.pos:
+            end_location = shifted
+
+    logging.debug(
+        f"Reparsed lines {start_line + 1}-{end_line + region.delta + 1} incrementally"
+    )
+
+    return AstRoot(
+        commands=spliced,
+        location=previous_ast.location,
+        end_location=end_location,
+    )
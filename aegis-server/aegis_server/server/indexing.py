@@ -2,13 +2,12 @@ import builtins
 import inspect
 import logging
 import traceback
-from copy import copy, deepcopy
-from dataclasses import dataclass
+from copy import copy
+from dataclasses import dataclass, fields, replace
 from functools import reduce
 from types import ModuleType
 from typing import (
     Any,
-    Callable,
     Optional,
     TypeVar,
     cast,
@@ -52,6 +51,7 @@ from bolt import (
     Runtime,
 )
 from mecha import (
+    AbstractChildren,
     AbstractNode,
     AstBlock,
     AstChildren,
@@ -65,6 +65,7 @@ from mecha import (
     AstRoot,
     AstSelectorArgument,
     CompilationError,
+    Dispatcher,
     Mecha,
     MutatingReducer,
     Reducer,
@@ -82,7 +83,12 @@ from aegis_core.ast.metadata import (
     attach_metadata,
     retrieve_metadata,
 )
-from aegis_core.indexing.project_index import AegisProjectIndex, valid_resource_location
+from aegis_core.indexing.project_index import (
+    NO_LOCATION,
+    AegisProjectIndex,
+    IndexContribution,
+    valid_resource_location,
+)
 from aegis_core.reflection import (
     UNKNOWN_TYPE,
     FunctionInfo,
@@ -91,6 +97,7 @@ from aegis_core.reflection import (
     get_type_info,
 )
 
+from .cancellation import CancellationToken, CompilationCancelled
 from .shadows.compile_document import COMPILATION_RESULTS
 from .shadows.context import LanguageServerContext
 
@@ -250,6 +257,9 @@ def set_type_annotation(node: AstNode, value: Any):
 class InitialStep(Reducer):
     helpers: dict[str, Any] = extra_field(default_factory=dict)
 
+    # The modules imported by the document, their changes affect its types
+    imports: set[str] = extra_field(default_factory=set)
+
     @rule(AstFromImport)
     def from_import(self, from_import: AstFromImport):
         module_path = from_import.arguments[0]
@@ -258,12 +268,11 @@ class InitialStep(Reducer):
             return
 
         if module_path.namespace:
+            location = module_path.get_canonical_value()
+            self.imports.add(location)
+
             if (
-                not (
-                    compilation := COMPILATION_RESULTS.get(
-                        module_path.get_canonical_value()
-                    )
-                )
+                not (compilation := COMPILATION_RESULTS.get(location))
                 or compilation.compiled_module is None
             ):
                 return
@@ -321,6 +330,9 @@ class InitialStep(Reducer):
 class BindingStep(Reducer):
     index: AegisProjectIndex = required_field()
     source_path: str = required_field()
+
+    # Collects the definitions and references, applied to the index once indexed
+    contribution: IndexContribution = required_field()
     runtime: Runtime = required_field()
     mecha: Mecha = required_field()
 
@@ -479,18 +491,30 @@ class BindingStep(Reducer):
                         command.arguments[-1], (AstRoot, AstJson)
                     ) and not nested_root_found:
                         nested_root_found = True
-                        self.index[file_type].add_definition(
-                            resolved_path,
-                            self.source_path,
-                            (argument.location, argument.end_location),
+                        self.contribution.definitions.add(
+                            (
+                                file_type,
+                                resolved_path,
+                                (argument.location, argument.end_location),
+                            )
+                        )
+                        # The calls within the body are made by the nested resource
+                        self.contribution.scopes.add(
+                            (
+                                file_type,
+                                resolved_path,
+                                (command.location, command.end_location),
+                            )
                         )
                     # If the pattern isn't matched then just treat it as a reference
                     # and not a definition of thre resource
                     else:
-                        self.index[file_type].add_reference(
-                            resolved_path,
-                            self.source_path,
-                            (argument.location, argument.end_location),
+                        self.contribution.references.add(
+                            (
+                                file_type,
+                                resolved_path,
+                                (argument.location, argument.end_location),
+                            )
                         )
 
     @rule(AstBlock)
@@ -676,10 +700,104 @@ class Indexer(MutatingReducer):
         default=AstRoot(commands=AstChildren(children=[]))
     )
 
+    initial_values: InitialStep | None = extra_field(default=None)
+    bindings: BindingStep | None = extra_field(default=None)
+
+    token: CancellationToken | None = extra_field(default=None)
+
+    imports: set[str] = extra_field(default_factory=set)
+
+    # Built while indexing, None until the indexer ran
+    contribution: IndexContribution | None = extra_field(default=None)
+
+    def invoke(self, node: AbstractNode, *args, **kwargs) -> Any:
+        """
+        Index the node in a single traversal. Children are indexed first and each node
+        goes through the initial step, the nested location transformer and then the
+        binding step, which keeps the order the type annotations rely on.
+        """
+        # Checkpoint between the top-level commands
+        if self.token is not None and len(self.stack) == 1:
+            self.token.check()
+
+        self.stack.append(node)
+
+        to_replace: dict[str, AbstractNode | AstChildren[AbstractNode]] = {}
+
+        for f in fields(node):
+            attribute = getattr(node, f.name)
+            if isinstance(attribute, AbstractChildren):
+                result = type(attribute)(
+                    self.invoke(child, *args, **kwargs) for child in attribute
+                )
+                if len(result) != len(attribute) or any(
+                    child is not original for child, original in zip(result, attribute)
+                ):
+                    to_replace[f.name] = result
+            elif isinstance(attribute, AbstractNode):
+                result = self.invoke(attribute, *args, **kwargs)
+                if result is not attribute:
+                    to_replace[f.name] = result
+
+        if to_replace:
+            node = replace(node, **to_replace)
+
+        if self.initial_values is not None:
+            self.apply_rules(self.initial_values, node)
+
+        # Apply the nested location transformer's rules until the node settles
+        exhausted = False
+        while not exhausted:
+            exhausted = True
+
+            for name, transform in self.dispatch(node):
+                try:
+                    result = self.process(node, name, transform, *args, **kwargs)
+                except Exception as exc:
+                    self.rule_failed(name, exc)
+                    continue
+
+                if result is node:
+                    continue
+
+                if isinstance(result, AbstractNode):
+                    exhausted = False
+                    node = result
+                    break
+                elif result is None or isinstance(result, AbstractChildren):
+                    self.stack.pop()
+                    return result
+
+                raise CompilationError(f"Invalid node of type {type(result)}. ({name})")
+
+        if self.bindings is not None:
+            self.apply_rules(self.bindings, node)
+
+        self.stack.pop()
+        return node
+
+    def apply_rules(self, step: Dispatcher, node: AbstractNode):
+        """Apply the rules of the step to the node, a failing rule is skipped"""
+        for name, step_rule in step.dispatch(node):
+            try:
+                step.process(node, name, step_rule)
+            except Exception as exc:
+                self.rule_failed(name, exc)
+
+    def rule_failed(self, name: str | None, exc: Exception):
+        # Rule errors are wrapped by the dispatcher
+        if isinstance(exc, CompilationError) and exc.__cause__ is not None:
+            exc = cast(Exception, exc.__cause__)
+
+        if isinstance(exc, CompilationCancelled):
+            raise exc
+
+        tb = "\n".join(traceback.format_tb(exc.__traceback__))
+        logging.error(f"Error occured in rule {name} while indexing\n{exc}\n{tb}")
+
     def __call__(self, ast: AstRoot, *args) -> AbstractNode:
         project_index = self.ctx.inject(AegisProjectIndex)
 
-        mecha = self.ctx.inject(Mecha)
         runtime = self.ctx.inject(Runtime)
         module = runtime.modules[self.file_instance]
         # logging.debug(id(ast))
@@ -689,21 +807,21 @@ class Indexer(MutatingReducer):
         # A file always defines itself
         source_type = type(self.file_instance)
 
-        project_index[source_type].add_definition(
-            self.resource_location, self.source_path
+        self.contribution = IndexContribution()
+        self.contribution.definitions.add(
+            (source_type, self.resource_location, NO_LOCATION)
         )
 
-        # TODO: See if these steps can be merged into one
-
-        # Attaches the type annotations for assignments
-        initial_values = InitialStep(helpers=runtime.helpers)
+        # Attaches the type annotations for values and imports
+        self.initial_values = InitialStep(helpers=runtime.helpers, imports=self.imports)
 
         # The binding step is responsible for attaching the majority of type annotations
-        bindings = BindingStep(
+        self.bindings = BindingStep(
             index=project_index,
             source_path=self.source_path,
+            contribution=self.contribution,
             module=module,
-            runtime=self.ctx.inject(Runtime),
+            runtime=runtime,
             mecha=self.ctx.inject(Mecha),
             # argument parser to resource type
             parser_to_file_type={
@@ -721,22 +839,18 @@ class Indexer(MutatingReducer):
             )
         )
 
-        steps: list[Callable[[AstRoot], AstRoot]] = [
-            initial_values,
-            super().__call__,
-            bindings,
-        ]
-
-        for step in steps:
-            try:
-                ast = step(ast)
-            except CompilationError as e:
-                raise e.__cause__
-            except Exception as e:
-                tb = "\n".join(traceback.format_tb(e.__traceback__))
-                logging.error(f"Error occured during {step}\n{e}\n{tb}")
+        try:
+            ast = super().__call__(ast)
+        except CompilationCancelled:
+            raise
+        except CompilationError as e:
+            raise e.__cause__
+        except Exception as e:
+            tb = "\n".join(traceback.format_tb(e.__traceback__))
+            logging.error(f"Error occured while indexing\n{e}\n{tb}")
 
         self.output_ast = ast
 
-        # Return a deepcopy so subsequent compilation steps don't modify the parsed state
-        return deepcopy(ast)
+        # Ast nodes are immutable, subsequent compilation steps rebuild the nodes they
+        # change instead of modifying them so the indexed ast can be shared with them
+        return ast
@@ -0,0 +1,58 @@
+from threading import Lock
+from typing import Any
+
+from pygls.protocol import LanguageServerProtocol
+
+from .cancellation import CancellationToken
+
+__all__ = ["AegisProtocol"]
+
+
+class AegisProtocol(LanguageServerProtocol):
+    """
+    Hands out a cancellation token to every request. pygls can only cancel coroutine
+    handlers that haven't started yet, the token lets `$/cancelRequest` stop a running
+    compilation of a threaded handler as well.
+    """
+
+    _tokens: dict[int | str, tuple[CancellationToken, int]]
+    _tokens_by_params: dict[int, CancellationToken]
+    _tokens_lock: Lock
+
+    def __init__(self, server, converter):
+        super().__init__(server, converter)
+        self._tokens = {}
+        self._tokens_by_params = {}
+        self._tokens_lock = Lock()
+
+    def get_cancellation_token(self, params: Any) -> CancellationToken | None:
+        """The token of the request the params were received with"""
+        with self._tokens_lock:
+            return self._tokens_by_params.get(id(params))
+
+    def _handle_request(self, msg_id, method_name, params):
+        token = CancellationToken()
+
+        with self._tokens_lock:
+            self._tokens[msg_id] = (token, id(params))
+            self._tokens_by_params[id(params)] = token
+
+        super()._handle_request(msg_id, method_name, params)
+
+    def _handle_cancel_notification(self, msg_id):
+        with self._tokens_lock:
+            entry = self._tokens.get(msg_id)
+
+        if entry is not None:
+            entry[0].cancel()
+
+        # Threaded handlers are only known to this protocol
+        if entry is None or msg_id in self._request_futures:
+            super()._handle_cancel_notification(msg_id)
+
+    def _send_response(self, msg_id, result=None, error=None):
+        with self._tokens_lock:
+            if entry := self._tokens.pop(msg_id, None):
+                self._tokens_by_params.pop(entry[1], None)
+
+        super()._send_response(msg_id, result, error)
@@ -0,0 +1,134 @@
+from pathlib import Path
+from threading import Lock
+
+from beet import Context, Function, LootTable, NamespaceFile, Predicate
+from lsprotocol import types as lsp
+
+from aegis_core.ast.helpers import node_location_to_range
+from aegis_core.indexing.project_index import AegisProjectIndex, ResourceStatus
+from aegis_core.indexing.symbols import Symbol
+
+__all__ = ["ResourceDiagnostics", "TRACKED_RESOURCES"]
+
+# Resources only used through the game, like advancements, aren't reported
+TRACKED_RESOURCES: tuple[type[NamespaceFile], ...] = (Function, Predicate, LootTable)
+
+# Vanilla resources exist without being defined by the project
+BUILTIN_NAMESPACE = "minecraft"
+
+
+class ResourceDiagnostics:
+    """
+    Reports the resources of the project that are never referenced and the references
+    to resources that are never defined.
+
+    The project index records the resources whose status may have changed, only those
+    are checked again and only the documents where their diagnostics appear or
+    disappear are published. Nothing is reported before the project is indexed, the
+    references of the documents that haven't been compiled yet are missing.
+    """
+
+    ctx: Context
+    ready: bool
+
+    _reported: dict[Symbol, dict[str, list[lsp.Diagnostic]]]
+    _documents: dict[str, dict[Symbol, list[lsp.Diagnostic]]]
+    _lock: Lock
+
+    def __init__(self, ctx: Context):
+        self.ctx = ctx
+        self.ready = False
+
+        self._reported = {}
+        self._documents = {}
+        self._lock = Lock()
+
+    def flush(self):
+        """Publish the diagnostics of the resources whose status changed"""
+        if not self.ready:
+            return
+
+        project_index = self.ctx.inject(AegisProjectIndex)
+
+        with self._lock:
+            changed = set()
+
+            for symbol in project_index.pop_status_changes():
+                if symbol[0] not in TRACKED_RESOURCES:
+                    continue
+
+                diagnostics = self.check(project_index, symbol)
+
+                for uri in self._reported.pop(symbol, {}):
+                    self._documents[uri].pop(symbol, None)
+                    changed.add(uri)
+
+                if diagnostics:
+                    self._reported[symbol] = diagnostics
+
+                for uri, document_diagnostics in diagnostics.items():
+                    self._documents.setdefault(uri, {})[symbol] = document_diagnostics
+                    changed.add(uri)
+
+            published = {
+                uri: [
+                    diagnostic
+                    for symbol_diagnostics in self._documents.get(uri, {}).values()
+                    for diagnostic in symbol_diagnostics
+                ]
+                for uri in changed
+            }
+
+            for uri in changed:
+                if not self._documents.get(uri):
+                    self._documents.pop(uri, None)
+
+        for uri, diagnostics in published.items():
+            self.ctx.ls.publish_index_diagnostics(uri, diagnostics)
+
+    def check(
+        self, project_index: AegisProjectIndex, symbol: Symbol
+    ) -> dict[str, list[lsp.Diagnostic]]:
+        """The diagnostics of the resource, grouped by document"""
+        resource, resource_path = symbol
+        index = project_index[resource]
+        name = resource.snake_name.replace("_", " ").capitalize()
+
+        match index.get_status(resource_path):
+            case ResourceStatus.UNUSED:
+                if resource is Function and project_index.function_tags.get_tags(
+                    resource_path
+                ):
+                    return {}
+
+                pointers = index.get_definitions(resource_path)
+                message = f"{name} '{resource_path}' is never referenced"
+                severity = lsp.DiagnosticSeverity.Hint
+                tags = [lsp.DiagnosticTag.Unnecessary]
+
+            case ResourceStatus.DANGLING:
+                if resource_path.startswith(f"{BUILTIN_NAMESPACE}:"):
+                    return {}
+
+                pointers = index.get_references(resource_path)
+                message = f"{name} '{resource_path}' is not defined"
+                severity = lsp.DiagnosticSeverity.Warning
+                tags = None
+
+            case _:
+                return {}
+
+        diagnostics: dict[str, list[lsp.Diagnostic]] = {}
+
+        for source_path, *location in pointers:
+            diagnostics.setdefault(Path(source_path).as_uri(), []).append(
+                lsp.Diagnostic(
+                    range=node_location_to_range(location),
+                    message=message,
+                    severity=severity,
+                    source=type(self.ctx.ls).__name__,
+                    tags=tags,
+                )
+            )
+
+        return diagnostics
@@ -0,0 +1,104 @@
+import logging
+from threading import Lock, Timer
+from typing import Any, Callable
+
+from .cancellation import CancellationToken
+
+__all__ = ["DocumentScheduler"]
+
+
+class DocumentScheduler:
+    """
+    Debounces the compilations of each document, a burst of edits only
+    results in a single compilation of the newest version of the document.
+    A compilation that is still running when a newer version is scheduled is cancelled.
+    """
+
+    delay: float
+
+    _pending: dict[str, Timer]
+    _latest: dict[str, int]
+    _running: dict[str, CancellationToken]
+    _lock: Lock
+
+    def __init__(self, delay: float = 0.15):
+        self.delay = delay
+        self._pending = {}
+        self._latest = {}
+        self._running = {}
+        self._lock = Lock()
+
+    def schedule(
+        self,
+        uri: str,
+        version: int,
+        job: Callable[[CancellationToken], Any],
+        delay: float | None = None,
+    ):
+        """Run the job once no newer version of the document was scheduled for `delay` seconds"""
+        with self._lock:
+            self._latest[uri] = version
+
+            if pending := self._pending.pop(uri, None):
+                pending.cancel()
+
+            if running := self._running.pop(uri, None):
+                running.cancel()
+
+            timer = Timer(
+                self.delay if delay is None else delay,
+                self._run,
+                (uri, version, job),
+            )
+            timer.daemon = True
+            self._pending[uri] = timer
+
+        timer.start()
+
+    def _run(self, uri: str, version: int, job: Callable[[CancellationToken], Any]):
+        token = CancellationToken()
+
+        with self._lock:
+            if self._latest.get(uri) == version:
+                self._pending.pop(uri, None)
+                self._running[uri] = token
+
+        if self.is_superseded(uri, version):
+            logging.debug(f"Dropping compilation of `{uri}` version {version}")
+            return
+
+        try:
+            job(token)
+        finally:
+            with self._lock:
+                if self._running.get(uri) is token:
+                    del self._running[uri]
+
+    def is_superseded(self, uri: str, version: int | None) -> bool:
+        """Whether a newer version of the document has been scheduled since `version`"""
+        if version is None:
+            return False
+
+        latest = self._latest.get(uri)
+        return latest is not None and latest != version
+
+    def forget(self, uri: str):
+        with self._lock:
+            if pending := self._pending.pop(uri, None):
+                pending.cancel()
+
+            if running := self._running.pop(uri, None):
+                running.cancel()
+
+            self._latest.pop(uri, None)
+
+    def cancel_all(self):
+        with self._lock:
+            for pending in self._pending.values():
+                pending.cancel()
+
+            for running in self._running.values():
+                running.cancel()
+
+            self._pending.clear()
+            self._running.clear()
@@ -1,14 +1,16 @@
+import hashlib
 from dataclasses import dataclass
+from enum import IntEnum
 from typing import Any
 
 from beet.core.utils import extra_field
 from bolt import CompiledModule
-from mecha import AstNode, CompilationUnit, Diagnostic
+from mecha import AstNode, AstRoot, CompilationUnit, Diagnostic
 from tokenstream import InvalidSyntax
 
 from .context import LanguageServerContext
 
-__all__ = ["CompiledDocument"]
+__all__ = ["CompilationLevel", "CompiledDocument", "compilation_key"]
 
 
 COMPILATION_RESULTS: dict[str, "CompiledDocument"] = {}
@@ -16,6 +18,23 @@ COMPILATION_RESULTS: dict[str, "CompiledDocument"] = {}
 CompilationError = InvalidSyntax | Diagnostic
 
 
+class CompilationLevel(IntEnum):
+    """How far a document went through the compilation pipeline.
+
+    The value is the number of mecha steps that ran after parsing."""
+
+    PARSED = 0
+    INDEXED = 1
+    LINTED = 2
+    TRANSFORMED = 3
+
+
+def compilation_key(ctx: LanguageServerContext, source: str) -> str:
+    """Identifies the result of compiling the source in the current state of the project"""
+    digest = hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+    return f"{ctx.project_uuid}:{ctx.generation}:{digest}"
+
+
 @dataclass
 class CompiledDocument:
     ctx: LanguageServerContext
@@ -28,4 +47,21 @@ class CompiledDocument:
     compiled_unit: CompilationUnit | None
     compiled_module: CompiledModule | None
 
-    dependents: set[str] = extra_field(default_factory=set)
+    # The modules the document imports, recorded in the project's module graph
+    imports: set[str] = extra_field(default_factory=set)
+
+    # Fingerprint of the bindings the document exports to its importers
+    exports: str | None = extra_field(default=None)
+
+    # The source and error-free parse tree the document was compiled from,
+    # used as the base for incrementally reparsing edits
+    source: str | None = extra_field(default=None)
+    parse_tree: AstRoot | None = extra_field(default=None)
+
+    # Documents compiled by a worker process or restored from the disk cache
+    # have no compiled unit or module
+    compiled_remotely: bool = extra_field(default=False)
+
+    cache_key: str | None = extra_field(default=None)
+
+    level: CompilationLevel = extra_field(default=CompilationLevel.TRANSFORMED)
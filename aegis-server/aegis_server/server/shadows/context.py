@@ -1,6 +1,7 @@
 import uuid
 from contextlib import contextmanager
 from dataclasses import dataclass
+from threading import Lock
 
 import lsprotocol.types as lsp
 from beet import Context, NamespaceFile, PluginError, PluginSpec, ProjectConfig
@@ -25,6 +26,13 @@ class LanguageServerContext(Context):
         default_factory=dict
     )
 
+    # Compilations mutate the project's mecha database and pack so they are
+    # queued per project, independent projects can compile concurrently
+    compilation_lock: Lock = extra_field(default_factory=Lock)
+
+    # Bumped whenever a change may affect how the other documents compile
+    generation: int = extra_field(default=0)
+
     def require(self, *args: PluginSpec):
         """Execute the specified plugin."""
         for arg in args:
@@ -41,6 +49,10 @@ class LanguageServerContext(Context):
         with local_import_path(str(self.directory.resolve())), self.cache:
             yield self.inject(self._pipeline)
 
+    def bump_generation(self):
+        """Invalidate the cached compilation results of every document in the project"""
+        object.__setattr__(self, "generation", self.generation + 1)
+
     def get_resource_from_path(self, path: str) -> tuple[str, NamespaceFile] | None:
         return self.path_to_resource.get(path)
 
@@ -7,6 +7,7 @@ from aegis_server.providers import register_providers
 from beet import (
     LATEST_MINECRAFT_VERSION,
     Context,
+    FunctionTag,
     PluginSpec,
     ProjectBuilder,
     TemplateManager,
@@ -113,6 +114,9 @@ class ProjectBuilderShadow(ProjectBuilder):
 
             mc = ctx.inject(Mecha)
 
+            # Published once every file is indexed
+            stack.enter_context(project_index.batch())
+
             for pack in ctx.packs:
                 logging.debug("Enqueuing files in database")
                 # Add file to the compilation database
@@ -129,6 +133,11 @@ class ProjectBuilderShadow(ProjectBuilder):
                         path = os.path.normcase(path)
                         ctx.path_to_resource[str(path)] = (location, file)
                         project_index[type(file)].add_definition(location, path)
+
+                        if isinstance(file, FunctionTag):
+                            project_index.function_tags.set_tag(
+                                location, path, file.data.get("values", [])
+                            )
                     except:
                         continue
 
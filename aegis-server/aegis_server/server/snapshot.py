@@ -0,0 +1,271 @@
+import hashlib
+import logging
+import os
+import sqlite3
+from pathlib import Path
+from threading import Condition, Lock, Thread
+
+from beet import Context
+from tokenstream import SourceLocation
+
+from aegis_core.indexing.project_index import AegisProjectIndex, IndexContribution
+
+from .cache import cache_version
+
+__all__ = ["IndexSnapshot"]
+
+# Resolved on import, projects are loaded with their own working directory
+SNAPSHOT_DIR = Path("./.aegis_cache").absolute() / "indices"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    source TEXT NOT NULL,
+    kind INTEGER NOT NULL,
+    resource_type TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    start_pos INTEGER NOT NULL,
+    start_line INTEGER NOT NULL,
+    start_col INTEGER NOT NULL,
+    end_pos INTEGER NOT NULL,
+    end_line INTEGER NOT NULL,
+    end_col INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_source ON entries (source);
+"""
+
+DEFINITION = 0
+REFERENCE = 1
+SCOPE = 2
+
+
+def source_digest(source: str) -> str:
+    return hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+
+
+class IndexSnapshot:
+    """
+    Persists the contributions of every compiled source file to the project index
+    in a SQLite database. A restarted server restores the contributions of the files
+    that are unchanged on disk, so references are known before the files are opened.
+
+    Compilations only queue their contribution, a writer thread persists the latest
+    contribution of each source file so no I/O happens while compiling.
+    """
+
+    ctx: Context
+    path: Path
+
+    _connection: sqlite3.Connection | None
+    _lock: Lock
+
+    _pending: dict[str, tuple[str, IndexContribution]]
+    _condition: Condition
+    _thread: Thread | None
+    _alive: bool
+
+    def __init__(self, ctx: Context):
+        self.ctx = ctx
+
+        name = hashlib.blake2b(
+            str(ctx.directory.resolve()).encode(), digest_size=16
+        ).hexdigest()
+        self.path = SNAPSHOT_DIR / f"{name}.sqlite"
+
+        self._connection = None
+        self._lock = Lock()
+
+        self._pending = {}
+        self._condition = Condition()
+        self._thread = None
+        self._alive = True
+
+    def connect(self) -> sqlite3.Connection:
+        if self._connection is not None:
+            return self._connection
+
+        SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+
+        connection = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+        connection.executescript(SCHEMA)
+
+        # Entries created by another toolchain or config can't be trusted
+        version = cache_version(self.ctx)
+        row = connection.execute(
+            "SELECT value FROM meta WHERE key = 'version'"
+        ).fetchone()
+
+        if row is None or row[0] != version:
+            with connection:
+                connection.execute("DELETE FROM entries")
+                connection.execute("DELETE FROM sources")
+                connection.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,)
+                )
+
+        self._connection = connection
+        return connection
+
+    def update(self, path: str, source: str, contribution: IndexContribution):
+        """Queue the latest contribution of the source file to replace its snapshot"""
+        with self._condition:
+            if not self._alive:
+                return
+
+            # Only the latest contribution of the file is written
+            self._pending[path] = (source, contribution)
+
+            if self._thread is None:
+                self._thread = Thread(
+                    target=self._work, name="aegis-snapshot", daemon=True
+                )
+                self._thread.start()
+
+            self._condition.notify()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while self._alive and not self._pending:
+                    self._condition.wait()
+
+                if not self._pending:
+                    return
+
+                pending = self._pending
+                self._pending = {}
+
+            self.write(pending)
+
+    def write(self, pending: dict[str, tuple[str, IndexContribution]]):
+        """Replace the snapshots of the source files in a single transaction"""
+        sources = []
+        rows = []
+
+        for path, (source, contribution) in pending.items():
+            # The mtime is only recorded when the compiled source is the one on disk,
+            # unsaved changes are validated against the hash instead
+            try:
+                with open(path, "r", encoding="utf-8", newline="") as file:
+                    on_disk = file.read() == source
+                mtime = os.stat(path).st_mtime if on_disk else None
+            except OSError:
+                mtime = None
+
+            sources.append((path, mtime, source_digest(source)))
+            rows.extend(
+                (path, kind, resource.snake_name, file, *pointer[0], *pointer[1])
+                for kind, entries in (
+                    (DEFINITION, contribution.definitions),
+                    (REFERENCE, contribution.references),
+                    (SCOPE, contribution.scopes),
+                )
+                for resource, file, pointer in entries
+            )
+
+        try:
+            with self._lock:
+                connection = self.connect()
+
+                with connection:
+                    connection.executemany(
+                        "DELETE FROM entries WHERE source = ?",
+                        [(path,) for path in pending],
+                    )
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO sources VALUES (?, ?, ?)", sources
+                    )
+                    connection.executemany(
+                        "INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        rows,
+                    )
+        except sqlite3.Error as exc:
+            logging.error(f"Failed to update the index snapshot\n{exc}")
+
+    def restore(self, index: AegisProjectIndex) -> int:
+        """Add the snapshot of every unchanged source file to the index, returns how many were restored"""
+        try:
+            with self._lock:
+                connection = self.connect()
+                sources = connection.execute(
+                    "SELECT path, mtime, digest FROM sources"
+                ).fetchall()
+
+                stale = [
+                    path
+                    for path, mtime, digest in sources
+                    if not self.is_unchanged(path, mtime, digest)
+                ]
+
+                with connection:
+                    for path in stale:
+                        connection.execute(
+                            "DELETE FROM entries WHERE source = ?", (path,)
+                        )
+                        connection.execute(
+                            "DELETE FROM sources WHERE path = ?", (path,)
+                        )
+
+                rows = connection.execute("SELECT * FROM entries").fetchall()
+        except sqlite3.Error as exc:
+            logging.error(f"Failed to restore the index snapshot\n{exc}")
+            return 0
+
+        contributions: dict[str, IndexContribution] = {}
+
+        for source, kind, resource_type, file, *location in rows:
+            if not (resource := index.resource_name_to_type.get(resource_type)):
+                continue
+
+            pointer = (SourceLocation(*location[:3]), SourceLocation(*location[3:]))
+            contribution = contributions.setdefault(source, IndexContribution())
+
+            if kind == DEFINITION:
+                contribution.definitions.add((resource, file, pointer))
+            elif kind == SCOPE:
+                contribution.scopes.add((resource, file, pointer))
+            else:
+                contribution.references.add((resource, file, pointer))
+
+        with index.batch():
+            for source, contribution in contributions.items():
+                index.set_contribution(source, contribution)
+
+        logging.debug(
+            f"Restored {len(contributions)} files from the index snapshot, {len(stale)} were stale"
+        )
+
+        return len(contributions)
+
+    def is_unchanged(self, path: str, mtime: float | None, digest: str) -> bool:
+        try:
+            if mtime is not None and os.stat(path).st_mtime == mtime:
+                return True
+
+            with open(path, "r", encoding="utf-8", newline="") as file:
+                return source_digest(file.read()) == digest
+        except OSError:
+            return False
+
+    def close(self):
+        """Write the queued contributions and close the database"""
+        with self._condition:
+            self._alive = False
+            self._condition.notify()
+            thread = self._thread
+
+        if thread is not None:
+            thread.join(timeout=5)
+
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from beet import Function, locate_config
+from mecha import AstNode
+from pygls.workspace import TextDocument
+
+from aegis_core.indexing.project_index import AegisProjectIndex, IndexContribution
+
+from .features.validate import parse_function
+from .shadows.compile_document import CompilationError, CompiledDocument
+from .shadows.context import LanguageServerContext
+
+__all__ = ["CompilationWorkers", "RemoteCompilation"]
+
+
+@dataclass
+class RemoteCompilation:
+    """The part of a compilation that is shipped back from a worker process"""
+
+    ast: AstNode | None
+    diagnostics: list[CompilationError]
+    contribution: IndexContribution
+    imports: set[str]
+
+
+# Each worker process keeps its own server and a warm context per project
+_worker_server = None
+_worker_contexts: dict[str, LanguageServerContext] = {}
+
+
+def initialize_worker(sites: list[str]):
+    global _worker_server
+
+    from .. import __version__
+    from . import AegisServer
+
+    _worker_server = AegisServer("aegis-worker", __version__)
+    _worker_server.set_sites(sites)
+
+
+def get_worker_context(directory: str) -> LanguageServerContext | None:
+    if ctx := _worker_contexts.get(directory):
+        return ctx
+
+    if _worker_server is None or not (config_path := locate_config(Path(directory))):
+        return None
+
+    # The snapshot and the disk cache belong to the server's process
+    if ctx := _worker_server.create_instance(config_path, restore=False):
+        _worker_contexts[directory] = ctx
+
+    return ctx
+
+
+def compile_in_worker(
+    directory: str, uri: str, source: str
+) -> RemoteCompilation | None:
+    """
+    Compile the function in the worker process, None if it has to be compiled by the
+    server. Only the compilation runs here, nothing is restored or written to disk.
+    """
+    try:
+        if not (ctx := get_worker_context(directory)):
+            return None
+
+        text_doc = TextDocument(uri, source)
+
+        path = os.path.normcase(os.path.normpath(text_doc.path))
+        if not (resource := ctx.path_to_resource.get(path)):
+            return None
+
+        compiled_doc = asyncio.run(
+            parse_function(
+                ctx, resource[0], text_doc.path, Function(source, text_doc.path)
+            )
+        )
+
+        # The worker only knows the modules as they are saved on disk
+        if compiled_doc.imports:
+            return None
+
+        return RemoteCompilation(
+            compiled_doc.ast,
+            compiled_doc.diagnostics,
+            ctx.inject(AegisProjectIndex).get_contribution(text_doc.path),
+            compiled_doc.imports,
+        )
+
+    except Exception as exc:
+        tb = "\n".join(traceback.format_tb(exc.__traceback__))
+        logging.error(f"Failed to compile {uri} in worker\n{exc}\n{tb}")
+        return None
+
+
+class CompilationWorkers:
+    """
+    Runs compilations in a pool of worker processes so they aren't bound by the GIL.
+    Only the ast, diagnostics and index contribution of the document are shipped back.
+
+    Only functions that don't import modules are compiled by the workers. Modules are
+    needed in the server's process by their importers, and the workers don't see the
+    unsaved changes of the modules a function could import.
+    """
+
+    _executor: ProcessPoolExecutor
+
+    def __init__(self, count: int, sites: list[str]):
+        self._executor = ProcessPoolExecutor(
+            max_workers=count,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=initialize_worker,
+            initargs=(sites,),
+        )
+
+    async def compile(
+        self,
+        ctx: LanguageServerContext,
+        resource_location: str,
+        text_doc: TextDocument,
+    ) -> tuple[CompiledDocument, IndexContribution] | None:
+        source = text_doc.source
+
+        try:
+            result = await asyncio.wrap_future(
+                self._executor.submit(
+                    compile_in_worker, str(ctx.directory), text_doc.uri, source
+                )
+            )
+        except Exception as exc:
+            # Also raised when the result references objects that can't be pickled
+            logging.error(f"Compilation worker failed for {text_doc.path}\n{exc}")
+            return None
+
+        if result is None:
+            return None
+
+        compiled_doc = CompiledDocument(
+            ctx=ctx,
+            resource_location=resource_location,
+            ast=result.ast,
+            diagnostics=result.diagnostics,
+            compiled_unit=None,
+            compiled_module=None,
+            source=source,
+            compiled_remotely=True,
+            imports=result.imports,
+        )
+
+        return compiled_doc, result.contribution
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,57 @@
+import json
+from pathlib import Path
+from typing import Callable
+
+import pytest
+from lsprotocol import types as lsp
+
+from aegis_server.server import AegisServer
+from aegis_server.server.shadows.compile_document import COMPILATION_RESULTS
+
+CreateServer = Callable[[dict[str, str]], AegisServer]
+
+
+@pytest.fixture
+def create_server(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Create a server for a bolt project made of the given files"""
+
+    def create_server(files: dict[str, str]) -> AegisServer:
+        (tmp_path / "beet.json").write_text(
+            json.dumps(
+                {
+                    "require": ["bolt"],
+                    "data_pack": {"load": ["src"]},
+                    "pipeline": ["mecha"],
+                }
+            )
+        )
+
+        server = AegisServer("aegis-server", "test")
+
+        # The game registries are downloaded, nothing here needs them
+        monkeypatch.setattr(server, "load_registry", lambda *args: None)
+
+        server.lsp.lsp_initialize(
+            lsp.InitializeParams(
+                capabilities=lsp.ClientCapabilities(), root_uri=tmp_path.as_uri()
+            )
+        )
+
+        for name, source in files.items():
+            path = tmp_path / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(source)
+
+            server.workspace.put_text_document(
+                lsp.TextDocumentItem(path.as_uri(), path.suffix[1:], 1, source)
+            )
+
+        instance = server.create_instance(tmp_path / "beet.json")
+        assert instance is not None
+        server._instances[tmp_path] = instance
+
+        return server
+
+    yield create_server
+
+    COMPILATION_RESULTS.clear()
@@ -0,0 +1,100 @@
+import asyncio
+from pathlib import Path
+
+from lsprotocol import types as lsp
+
+from aegis_server.server.dependencies import ModuleGraph
+from aegis_server.server.features.validate import validate_function
+from aegis_server.server.shadows.compile_document import COMPILATION_RESULTS
+
+from .conftest import CreateServer
+
+
+def create_graph(imports: dict[str, set[str]]) -> ModuleGraph:
+    graph = ModuleGraph(None)  # type: ignore
+
+    for location, modules in imports.items():
+        graph.update(location, modules)
+
+    return graph
+
+
+def test_chain():
+    graph = create_graph({"demo:a": {"demo:b"}, "demo:b": {"demo:c"}})
+
+    assert graph.get_transitive_dependents("demo:c") == ["demo:b", "demo:a"]
+    assert graph.get_transitive_dependents("demo:b") == ["demo:a"]
+    assert graph.get_transitive_dependents("demo:a") == []
+
+
+def test_diamond():
+    graph = create_graph(
+        {
+            "demo:a": {"demo:b", "demo:c"},
+            "demo:b": {"demo:d"},
+            "demo:c": {"demo:d"},
+        }
+    )
+
+    order = graph.get_transitive_dependents("demo:d")
+
+    assert sorted(order) == ["demo:a", "demo:b", "demo:c"]
+    assert order[-1] == "demo:a"
+
+
+def test_cycle():
+    graph = create_graph(
+        {
+            "demo:a": {"demo:b", "demo:m"},
+            "demo:b": {"demo:a"},
+            "demo:c": {"demo:a"},
+            "demo:m": {"demo:c"},
+        }
+    )
+
+    # The modules in a cycle are still recompiled, each of them only once
+    order = graph.get_transitive_dependents("demo:m")
+    assert sorted(order) == ["demo:a", "demo:b", "demo:c"]
+
+    # A cycle through the recompiled module doesn't bring it back
+    order = graph.get_transitive_dependents("demo:a")
+    assert sorted(order) == ["demo:b", "demo:c", "demo:m"]
+    assert order[-1] == "demo:m"
+
+
+def test_update():
+    graph = create_graph({"demo:a": {"demo:b"}, "demo:c": {"demo:b"}})
+
+    graph.update("demo:a", set())
+
+    assert graph.get_dependents("demo:b") == {"demo:c"}
+    assert graph.get_transitive_dependents("demo:b") == ["demo:c"]
+
+
+def test_exports_across_recompilations(tmp_path: Path, create_server: CreateServer):
+    source = "value = 1\n\ndef add(x: int, y: int = 2) -> int:\n    return x + y\n"
+    server = create_server({"src/data/demo/modules/lib.bolt": source})
+    uri = (tmp_path / "src/data/demo/modules/lib.bolt").as_uri()
+    text_doc = server.workspace.get_document(uri)
+
+    with server.context(text_doc) as ctx:
+        assert ctx is not None
+
+    def compile_exports() -> str | None:
+        COMPILATION_RESULTS.clear()
+        asyncio.run(validate_function(ctx, text_doc, require_module=True))
+        return COMPILATION_RESULTS["demo:lib"].exports
+
+    exports = compile_exports()
+
+    assert exports is not None
+    assert compile_exports() == exports
+
+    # Only the interface changed by an edit changes the exports
+    server.workspace.update_text_document(
+        lsp.VersionedTextDocumentIdentifier(uri, 2),
+        lsp.TextDocumentContentChangeEvent_Type2(source + "x = value\n"),
+    )
+    text_doc = server.workspace.get_document(uri)
+
+    assert compile_exports() != exports
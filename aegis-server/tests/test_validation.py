@@ -1 +1,41 @@
-# TODO: Actually write LSP tests
+import asyncio
+from pathlib import Path
+
+from lsprotocol import types as lsp
+
+from aegis_server.server.features.rename import rename_variable
+from aegis_server.server.features.validate import validate_function
+from aegis_server.server.shadows.compile_document import COMPILATION_RESULTS
+
+from .conftest import CreateServer
+
+SOURCE = "value = 1\nother = value + 1\n"
+
+
+def test_rename_in_restored_document(tmp_path: Path, create_server: CreateServer):
+    server = create_server({"src/data/demo/function/foo.mcfunction": SOURCE})
+    uri = (tmp_path / "src/data/demo/function/foo.mcfunction").as_uri()
+    text_doc = server.workspace.get_document(uri)
+
+    with server.context(text_doc) as ctx:
+        assert ctx is not None
+
+    # Compiled in a previous session, the compilation is cached on disk
+    asyncio.run(validate_function(ctx, text_doc))
+    COMPILATION_RESULTS.clear()
+
+    asyncio.run(validate_function(ctx, text_doc))
+    (restored,) = COMPILATION_RESULTS.values()
+    assert restored.compiled_remotely and restored.compiled_module is None
+
+    edit = asyncio.run(
+        rename_variable(
+            server,
+            lsp.RenameParams(
+                lsp.TextDocumentIdentifier(uri), lsp.Position(0, 0), "renamed"
+            ),
+        )
+    )
+
+    assert edit is not None and edit.changes is not None
+    assert len(edit.changes[uri]) == 2